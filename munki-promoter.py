@@ -14,6 +14,24 @@ import urllib.request
 import urllib.parse
 import json
 import ssl
+import hashlib
+import fcntl
+import functools
+import time
+import concurrent.futures
+import atexit
+import sqlite3
+import heapq
+import copy
+import queue
+import logging.handlers
+import mmap
+import re
+import subprocess
+import tempfile
+import threading
+import socket
+import uuid
 
 DEFAULT_CONFIG = {
 	"promotions": {
@@ -26,6 +44,30 @@ DEFAULT_CONFIG = {
 
 CONFIG_FILE = "config.yml"
 MUNKI_PATH='/Users/Shared/munki-repo/pkgsinfo'
+LOCK_FILE = ".munki-promoter.lock"
+LOCK_RETRIES = 5
+LOCK_RETRY_DELAY = 0.2
+# seconds to wait for a lock in S3, and after which a lock object is left over from a run that did not remove it
+LOCK_TIMEOUT = 30 * 60
+LOCK_STALE_AFTER = 2 * 60 * 60
+READ_WORKERS = 16
+HASH_WORKERS = os.cpu_count() or 4
+PIPELINE_QUEUE_SIZE = 256
+PIPELINE_READERS = 8
+HASH_BUFFER_SIZE = 8 * 1024 * 1024
+HASH_CACHE_FILE = os.path.join(os.path.expanduser("~"), ".cache", "munki-promoter", "installer_hashes.db")
+EPOCH = datetime.datetime(1970, 1, 1)
+DAY_IN_MICROSECONDS = 24 * 60 * 60 * 1000000
+SUMMARY_MESSAGES = {
+	"creation_date": "{} items are missing a last edit date so their creation date is used, with the assumption that they have been in their current catalog(s) since creation.",
+	"edit_date_set": "{} items are missing a creation date so munki-promoter set their last edit date to today.",
+	"metadata_added": "Added missing metadata to {} items.",
+	"reevaluated": "Re-evaluated {} items that were changed by another process since they were read.",
+	"promoted": "Promoted {} items.",
+	"excluded": "Excluded {} items from promotion because their installer could not be verified.",
+	"held": "Held back {} items because their dependencies will not be available in their new catalogs.",
+	"pulled": "Pulled along {} dependencies of items that are promoted.",
+}
 
 _BOOLMAP = {
 	'y': True,
@@ -43,7 +85,15 @@ _BOOLMAP = {
 }
 
 using_default_config = False
+log_listener = None
 	
+# ----------------------------------------
+# 				Errors
+# ----------------------------------------
+class PromoterError(Exception):
+	# raised instead of exiting, so munki-promoter can be used as a library
+	pass
+
 # ----------------------------------------
 # 				Strings
 # ----------------------------------------
@@ -65,7 +115,7 @@ def white_space_pad_strings(l):
 	result = [s + (' ' * (maxlen - len(s))) for s in l]
 	return result 
 
-def describe_promotion(promotion, promote_to, names, versions, custom_item_descriptions):
+def describe_promotion(promotion, promote_to, names, versions, custom_item_descriptions, excluded=None):
 	result = "\n------------------------------------------------------------------------------------\n"
 	result += f'                        Applying promotion "{promotion}"\n'
 	result += f"   Promoting the catalogs of the following pkgsinfo files to {promote_to}\n"
@@ -81,6 +131,11 @@ def describe_promotion(promotion, promote_to, names, versions, custom_item_descr
 		result += "The following pkgsinfo files are custom items that impact which catalog they will be promoted to:\n"
 		for i, name in enumerate(custom_names):
 			result += f"{name} - {custom_versions[i]} - will be promoted to {and_str(custom_promote_tos[i])} \n"
+	if excluded:
+		excluded_names = white_space_pad_strings([f"{item['name']} - {item['version']}" for item in excluded])
+		result += "The following pkgsinfo files are eligible but will not be promoted:\n"
+		for i, name in enumerate(excluded_names):
+			result += f"{name} - {excluded[i]['reason']}\n"
 	return result
 
 # ----------------------------------------
@@ -94,16 +149,14 @@ def get_config(config_path, is_config_specified) -> dict:
 			# import success BUT no file 
 			if is_config_specified:
 				# file was user provided -> error: user provided file should exist
-				logging.error(f"Configuration file {config_path} is not present.")
-				sys.exit(1)
+				raise PromoterError(f"Configuration file {config_path} is not present.")
 			else:
 				# file was not user provided -> warning: use defaults
 				logging.warning("No configuration file is present. Will continue with default settings.")
 				return DEFAULT_CONFIG
 		# import success AND file exists
 		if not os.access(config_path, os.R_OK):
-			logging.error(f"You don't have access to {config_path}")
-			sys.exit(1)	
+			raise PromoterError(f"You don't have access to {config_path}")
 		with open(config_path, "r") as config_yaml:
 			logging.info(f"Loading {config_path} ...")
 			try:
@@ -111,19 +164,15 @@ def get_config(config_path, is_config_specified) -> dict:
 				logging.info(f"Successfully loaded {config_path}!")
 				return result
 			except yaml.YAMLError:
-				logging.error(f"Unable to load {config_path}")
-				sys.exit(1)
+				raise PromoterError(f"Unable to load {config_path}")
 	except ModuleNotFoundError as e:
 		# import unsuccessful
 		if os.path.exists(config_path):
 			# import unsuccessful AND file exists -> error: should be able to read file
-			logging.error(f"Missing dependency to read configuration file: {e}")
-			sys.exit(1)
+			raise PromoterError(f"Missing dependency to read configuration file: {e}")
 		elif is_config_specified:
 			# import unsuccessful AND no file BUT file was user provided -> error: user provided file should be readable
-			logging.error(f"Missing dependency to read configuration file: {e}")
-			logging.error(f"Configuration file {config_path} is not present.")
-			sys.exit(1)
+			raise PromoterError(f"Missing dependency to read configuration file: {e}. Configuration file {config_path} is not present.")
 		else:
 			# import unsuccessful But no file -> warning: use defaults
 			logging.warning("PyYAML library could not be loaded, but no configuration file is present. Will continue with default settings.")
@@ -139,30 +188,24 @@ def check_config(config, config_path):
 						for promotion in config[key]:
 							check_config_promotion(config[key][promotion], promotion, config_path)
 					else:
-						logging.error(f"Unexpected format of config file. {key} is expected to be type dictionary but is type {type(config[key])}. Please update config file at {config_path}")
-						sys.exit(1)
+						raise PromoterError(f"Unexpected format of config file. {key} is expected to be type dictionary but is type {type(config[key])}. Please update config file at {config_path}")
 				case "default_days_in_catalog":
 					if not isinstance(config[key], int):
-						logging.error(f"Unexpected format of config file. {key} is expected to be type int but is type {type(config[key])}. Please update config file at {config_path}")
-						sys.exit(1)
+						raise PromoterError(f"Unexpected format of config file. {key} is expected to be type int but is type {type(config[key])}. Please update config file at {config_path}")
 				case "selections":
 					if isinstance(config[key], list):
 						for i, selection in enumerate(config[key]):
 							check_config_selection(selection, i+1, config_path)
 					else:
-						logging.error(f"Unexpected format of config file. {key} is expected to be type dictionary but is type {type(config[key])}. Please update config file at {config_path}")
-						sys.exit(1)
+						raise PromoterError(f"Unexpected format of config file. {key} is expected to be type dictionary but is type {type(config[key])}. Please update config file at {config_path}")
 				case "selection":
 					new_selections = handle_selection_deprecated(config, config_path)
 				case _:
-					logging.error(f"Unknown key(s) in config file: {str(set(config.keys()).difference(top_level_keys))[1 : -1]}. Please update config file at {config_path}")
-					sys.exit(1)
+					raise PromoterError(f"Unknown key(s) in config file: {str(set(config.keys()).difference(top_level_keys))[1 : -1]}. Please update config file at {config_path}")
 	else:
-		logging.error(f"Unexpected format of config file. Expected file in the format of dictionary, but instead file is formatted as {type(config)}. Please update config file at {config_path}")
-		sys.exit(1)
+		raise PromoterError(f"Unexpected format of config file. Expected file in the format of dictionary, but instead file is formatted as {type(config)}. Please update config file at {config_path}")
 	if not ("promotions" in config):
-		logging.error(f"Missing required key \"promotions\" in config file. Please update config file at {config_path}")
-		sys.exit(1)
+		raise PromoterError(f"Missing required key \"promotions\" in config file. Please update config file at {config_path}")
 	if new_selections:
 		config["selections"] = new_selections
 
@@ -175,31 +218,24 @@ def check_config_promotion(promotion, promotion_name, config_path):
 			for key in keys:
 				if key in ["promote_from", "promote_to"]:
 					if not isinstance(promotion[key], list):
-						logging.error(f"Unexpected format of config file. {key} in promotion {promotion_name} is expected to be type list but is type {type(promotion[key])}. Please update config file at {config_path}")
-						sys.exit(1)
+						raise PromoterError(f"Unexpected format of config file. {key} in promotion {promotion_name} is expected to be type list but is type {type(promotion[key])}. Please update config file at {config_path}")
 					for el in promotion[key]:
 						if not isinstance(el, str):
-							logging.error(f"Unexpected format of config file. All elements of {key} in promotion {promotion_name} should be type string, but the element {el} is type {type(el)}. Please update config file at {config_path}")
-							sys.exit(1)
+							raise PromoterError(f"Unexpected format of config file. All elements of {key} in promotion {promotion_name} should be type string, but the element {el} is type {type(el)}. Please update config file at {config_path}")
 				elif key == "custom_items":
 					if isinstance(promotion[key], dict):
 						for custom_item in promotion[key]:
 							check_config_custom_item(promotion[key][custom_item], custom_item, promotion_name, config_path)
 					else:
-						logging.error(f"Unexpected format of config file. {key} in promotion {promotion_name} is expected to be type dictionary but is type {type(promotion[key])}. Please update config file at {config_path}")
-						sys.exit(1)
+						raise PromoterError(f"Unexpected format of config file. {key} in promotion {promotion_name} is expected to be type dictionary but is type {type(promotion[key])}. Please update config file at {config_path}")
 				elif not isinstance(promotion[key], int):
-					logging.error(f"Unexpected format of config file. {key} in promotion {promotion_name} is expected to be type int but is type {type(promotion[key])}. Please update config file.")
-					sys.exit(1)
+					raise PromoterError(f"Unexpected format of config file. {key} in promotion {promotion_name} is expected to be type int but is type {type(promotion[key])}. Please update config file.")
 		else:
-			logging.error(f"Unknown key(s) in config file. Promotion {promotion_name} contains keys: {str(set(keys).difference(promotion_keys))[1 : -1]}. Please update config file at {config_path}.")
-			sys.exit(1)
+			raise PromoterError(f"Unknown key(s) in config file. Promotion {promotion_name} contains keys: {str(set(keys).difference(promotion_keys))[1 : -1]}. Please update config file at {config_path}.")
 	else:
-		logging.error(f"Unexpected format of config file. Promotion {promotion_name} is expected to be type dictionary, but is type {type(promotion)}. Please update config file at {config_path}.")
-		sys.exit(1)
+		raise PromoterError(f"Unexpected format of config file. Promotion {promotion_name} is expected to be type dictionary, but is type {type(promotion)}. Please update config file at {config_path}.")
 	if not ("promote_to" in promotion):
-		logging.error(f"Promotion {promotion_name} is missing required key \"promote_to\" in config file. Please update config file at {config_path}")
-		sys.exit(1)
+		raise PromoterError(f"Promotion {promotion_name} is missing required key \"promote_to\" in config file. Please update config file at {config_path}")
 
 def check_config_custom_item(custom_item, name, promotion, config_path):
 	custom_items_keys = {"promote_from", "promote_to", "days_in_catalog"}
@@ -209,21 +245,16 @@ def check_config_custom_item(custom_item, name, promotion, config_path):
 			for key in keys:
 				if key in ["promote_from", "promote_to"]:
 					if not isinstance(custom_item[key], list):
-						logging.error(f"Unexpected format of config file. {key} in custom item {name} in promotion {promotion} is expected to be type list but is type {type(custom_item[key])}. Please update config file at {config_path}")
-						sys.exit(1)
+						raise PromoterError(f"Unexpected format of config file. {key} in custom item {name} in promotion {promotion} is expected to be type list but is type {type(custom_item[key])}. Please update config file at {config_path}")
 					for el in custom_item[key]:
 						if not isinstance(el, str):
-							logging.error(f"Unexpected format of config file. All elements of {key} in custom item {name} in promotion {promotion} should be type string, but the element {el} is type {type(el)}. Please update config file at {config_path}")
-							sys.exit(1)
+							raise PromoterError(f"Unexpected format of config file. All elements of {key} in custom item {name} in promotion {promotion} should be type string, but the element {el} is type {type(el)}. Please update config file at {config_path}")
 				elif not isinstance(custom_item[key], int):
-					logging.error(f"Unexpected format of config file. {key} in custom item {name} in promotion {promotion} is expected to be type int but is type {type(custom_item[key])}. Please update config file.")
-					sys.exit(1)
+					raise PromoterError(f"Unexpected format of config file. {key} in custom item {name} in promotion {promotion} is expected to be type int but is type {type(custom_item[key])}. Please update config file.")
 		else:
-			logging.error(f"Unknown key(s) in config file. Custom item {name} in promotion {promotion} contains keys: {str(set(keys).difference(custom_items_keys))[1 : -1]}. Please update config file at {config_path}.")
-			sys.exit(1)
+			raise PromoterError(f"Unknown key(s) in config file. Custom item {name} in promotion {promotion} contains keys: {str(set(keys).difference(custom_items_keys))[1 : -1]}. Please update config file at {config_path}.")
 	else:
-		logging.error(f"Unexpected format of config file. Custom item {name} in promotion {promotion} is expected to be type dictionary, but is type {type(custom_item)}. Please update config file at {config_path}.")
-		sys.exit(1)
+		raise PromoterError(f"Unexpected format of config file. Custom item {name} in promotion {promotion} is expected to be type dictionary, but is type {type(custom_item)}. Please update config file at {config_path}.")
 
 def check_config_selection(selection, i, config_path):
 	selection_keys = {"type", "key", "values"}
@@ -233,17 +264,13 @@ def check_config_selection(selection, i, config_path):
 			for key in keys:
 				if key in ["type", "key"]:
 					if not isinstance(selection[key], str):
-						logging.error(f"Unexpected format of config file. {key} in selection {i} is expected to be type str but is type {type(selection[key])}. Please update config file at {config_path}")
-						sys.exit(1)
+						raise PromoterError(f"Unexpected format of config file. {key} in selection {i} is expected to be type str but is type {type(selection[key])}. Please update config file at {config_path}")
 				elif not isinstance(selection[key], list):
-					logging.error(f"Unexpected format of config file. {key} in selection {i} is expected to be type list but is type {type(selection[key])}. Please update config file at {config_path}")
-					sys.exit(1)
+					raise PromoterError(f"Unexpected format of config file. {key} in selection {i} is expected to be type list but is type {type(selection[key])}. Please update config file at {config_path}")
 		else:
-			logging.error(f"Unknown key(s) in config file. Selection {i} contains keys: {str(set(selection.keys()).difference(selection_keys))[1 : -1]}. Please update config file at {config_path}.")
-			sys.exit(1)
+			raise PromoterError(f"Unknown key(s) in config file. Selection {i} contains keys: {str(set(selection.keys()).difference(selection_keys))[1 : -1]}. Please update config file at {config_path}.")
 	else:
-		logging.error(f"Unexpected format of config file. Selection {i} is expected to be type dictionary, but is type {type(selection)}. Please update config file at {config_path}.")
-		sys.exit(1)
+		raise PromoterError(f"Unexpected format of config file. Selection {i} is expected to be type dictionary, but is type {type(selection)}. Please update config file at {config_path}.")
 	if "type" in selection:
 		match selection["type"]:
 			case "inclusion":
@@ -253,8 +280,7 @@ def check_config_selection(selection, i, config_path):
 				if "values" not in selection or len(selection["values"]) < 1:
 					logging.warning(f"Selection {i} type set to exclusion but no list of items defined in {config_path}. All items will be considered.")
 			case _:
-				logging.error("Selection {i} type set incorrectly in {config_path}. Selection type must be \"inclusion\" or \"exclusion\", but was set to {selection['type']}.")
-				sys.exit(1)
+				raise PromoterError("Selection {i} type set incorrectly in {config_path}. Selection type must be \"inclusion\" or \"exclusion\", but was set to {selection['type']}.")
 	# default values
 	if not "type" in selection:
 		selection["type"] = "inclusion"
@@ -266,8 +292,7 @@ def check_config_selection(selection, i, config_path):
 def handle_selection_deprecated(config, config_path):
 	selection = config["selection"]
 	if "selections" in config:
-		logging.error(f"`selection` key in config is deprecated and conflicts with new Selections key. Please remove it from {config_path}")
-		sys.exit(1)
+		raise PromoterError(f"`selection` key in config is deprecated and conflicts with new Selections key. Please remove it from {config_path}")
 	if "type" in selection and selection["type"] in ["inclusion", "exclusion", "all"]:
 		if selection["type"] == "all":
 			logging.warning(f"`selection` key in config is deprecated. Please remove it from {config_path}. There will be no change in behaviour due to the selection type being all.")
@@ -279,8 +304,7 @@ def handle_selection_deprecated(config, config_path):
 		logging.warning(f"`selection` key in config is deprecated. Please update to using `selections` soon in {config_path}\nTo keep your current selection with the new key please replace it with the following:\nselections: \n  - type: \"{selection['type']}\"\n    key: \"name\"\n    values: \n{items}")
 		return [{"type": selection["type"], "key": "name", "values": selection["items"]}]
 	else:
-		logging.error(f"`selection` key in config is deprecated. Please use new `selections` key instead in {config_path}")
-		sys.exit(1)
+		raise PromoterError(f"`selection` key in config is deprecated. Please use new `selections` key instead in {config_path}")
 
 
 # ----------------------------------------
@@ -351,13 +375,11 @@ def get_promotion_info(promotion, promotions, config, config_path):
 		elif "default_days_in_catalog" in config:
 			days = config["default_days_in_catalog"]
 		else:
-			logging.error(f'Promotion "{promotion}" improperly defined! `days_in_catalog` is undefined and no `default_days_in_catalog` has been defined. Promotions can be configured in {config_path}. Use --list to see valid catalogs to promote.')
-			sys.exit(1)
+			raise PromoterError(f'Promotion "{promotion}" improperly defined! `days_in_catalog` is undefined and no `default_days_in_catalog` has been defined. Promotions can be configured in {config_path}. Use --list to see valid catalogs to promote.')
 		return promote_to, promote_from, days, custom_items
 	else:
 		# error: catalog has no promotions
-		logging.error(f'Promotion "{promotion}" improperly defined! Which catalog(s) promotion "{promotion}" promotes to is undefined. Promotions can be configured in {config_path}. Use --list to see valid catalogs to promote.')
-		sys.exit(1)
+		raise PromoterError(f'Promotion "{promotion}" improperly defined! Which catalog(s) promotion "{promotion}" promotes to is undefined. Promotions can be configured in {config_path}. Use --list to see valid catalogs to promote.')
 
 # ----------------------------------------
 # 					Slack
@@ -365,8 +387,7 @@ def get_promotion_info(promotion, promotions, config, config_path):
 def send_slack_webhook(slack_url, slack_blocks):
 	parsed_url = urllib.parse.urlparse(slack_url)
 	if parsed_url.scheme != "https":
-		logging.error("Slack webhook URL must use HTTPS.")
-		sys.exit(1)
+		raise PromoterError("Slack webhook URL must use HTTPS.")
 	context_block = {"type": "context", "elements": [{"type": "mrkdwn", "text": ":monkey_face: This message brought to you by <https://github.com/jc0b/munki-promoter|munki-promoter>."}]}
 	slack_blocks.append(context_block)
 	slack_blocks.append({"type": "divider"})
@@ -378,10 +399,9 @@ def send_slack_webhook(slack_url, slack_blocks):
 	if resp.status == 200:
 		logging.info("Slack webhook sent successfully!")
 	else:
-		logging.error(f"Slack webhook could not be sent. HTTP response {resp.status}.")
-		sys.exit(1)
+		raise PromoterError(f"Slack webhook could not be sent. HTTP response {resp.status}.")
 
-def add_to_slack_blocks(blocks, promotion, promote_to, names, versions, custom_item_descriptions):
+def add_to_slack_blocks(blocks, promotion, promote_to, names, versions, custom_item_descriptions, excluded=None):
 	heading_element = {"type": "text", "text": f'Applied promotion "{promotion}".', "style": {"bold": True}}
 	blocks.append({"type": "rich_text", "elements": [{"type": "rich_text_section","elements": [heading_element]}]})
 
@@ -410,6 +430,14 @@ def add_to_slack_blocks(blocks, promotion, promote_to, names, versions, custom_i
 				custom_item_blocks.append({"type": "rich_text_section", "elements": [{"type": "text", "text": f"{name} - {custom_versions[i]} - promoted to Munki {and_str(custom_promote_tos[i])} catalog\n"}]})
 		blocks.append({"type": "rich_text", "elements": [{"type": "rich_text_list", "style": "bullet", "indent": 0, "border": 0, "elements": custom_item_blocks}]})
 
+	if excluded:
+		excluded_subheading = {"type": "text", "text": "The following items were eligible but have not been promoted:"}
+		blocks.append({"type": "rich_text", "elements": [{"type": "rich_text_section","elements": [excluded_subheading]}]})
+		excluded_item_blocks = []
+		for item in excluded:
+			excluded_item_blocks.append({"type": "rich_text_section", "elements": [{"type": "text", "text": f"{item['name']} - {item['version']} - {item['reason']}\n"}]})
+		blocks.append({"type": "rich_text", "elements": [{"type": "rich_text_list", "style": "bullet", "indent": 0, "border": 0, "elements": excluded_item_blocks}]})
+
 	return blocks
 
 def add_slack_div(blocks):
@@ -421,9 +449,7 @@ def setup_slack_blocks():
 		global certifi
 		import certifi
 	except ImportError:
-			logging.error(f"Certifi library could not be loaded.")
-			logging.error("You can install the necessary dependencies with 'python3 -m pip install -r requirements.txt'")
-			sys.exit(1)
+			raise PromoterError("Certifi library could not be loaded. You can install the necessary dependencies with 'python3 -m pip install -r requirements.txt'")
 	header_block = {"type": "header", "text": {"type": "plain_text", "text": "New items automatically promoted in Munki", "emoji": True}}
 	return [header_block]
 
@@ -437,11 +463,10 @@ def write_md_file(md_file, md):
 		f.close()
 		logging.info("Markdown file successfully updated.")
 	except:
-		logging.error(f"Unable to write to {md_file}")
-		sys.exit(1)
+		raise PromoterError(f"Unable to write to {md_file}")
 
 
-def md_description(promotion, promote_to, names, versions, custom_item_descriptions):
+def md_description(promotion, promote_to, names, versions, custom_item_descriptions, excluded=None):
 	result = f'Applied promotion "{promotion}".\n'
 	if len(names) > 0:
 		if len(promote_to) > 1:
@@ -461,146 +486,144 @@ def md_description(promotion, promote_to, names, versions, custom_item_descripti
 				result += f"- {name}: {custom_versions[i]} (promoted to Munki {and_str(custom_promote_tos[i])} catalogs)\n"
 			else:
 				result += f"- {name}: {custom_versions[i]} (promoted to Munki {and_str(custom_promote_tos[i])} catalog)\n"
+	if excluded:
+		result += "The following items were eligible but have not been promoted:\n"
+		for item in excluded:
+			result += f"- {item['name']}: {item['version']} ({item['reason']})\n"
 	result += "\n"
 	return result
 
 # ----------------------------------------
 #					Munki
 # ----------------------------------------
-def get_munki_paths(munki_path):
-	result = []
-	if not os.path.exists(munki_path):
-			logging.error(f"Path to munki root directory {munki_path} does not exist.")
-			sys.exit(1)
-	if not os.access(munki_path, os.W_OK):
-		logging.error(f"You don't have access to {munki_path}")
-		sys.exit(1)
-	for root, dirs, files in os.walk(munki_path):
-		# collect all full paths where file does not start with a period (hidden files)
-		result += [os.path.join(root, file) for file in files if not file.startswith(".")] # check file does not start with a period (hidden files)
-	return result
+def get_munki_paths(storage):
+	return [path for path, size, etag in storage.list_items()]
+
+def read_pkgsinfo(storage, paths=None):
+	if paths is None:
+		paths = get_munki_paths(storage)
+	for file, data in storage.read_items(paths):
+		try:
+			# load file
+			pkginfo = plistlib.loads(data)
+		except plistlib.InvalidFileException as e:
+			raise PromoterError(f"Could not load file {file} in munki directory.") from e
+		yield file, pkginfo
 
-def prep_all_promotions(config, munki_path, config_path):
+def prep_all_promotions(config, storage, config_path, state_store=None, pkgsinfo=None, summary=None, evaluators=None, missing_edit_dates=None):
+	# returns (promotion, promote_to, pkginfo, item_promo_info) of every item to promote
+	if pkgsinfo is None:
+		pkgsinfo = read_pkgsinfo(storage)
+	records = []
+	if config and "promotions" in config and type(config["promotions"]) == dict:
+		for file, pkginfo in pkgsinfo:
+			# prep individual pkginfo for promotion
+			record = prep_pkginfo_all_promotions(pkginfo, file, config, config_path, state_store, summary, evaluators, missing_edit_dates)
+			if record:
+				records.append(record)
+		return records
+	else:
+		# error: bad yaml config
+		raise PromoterError(f'No promotions are currently defined in {config_path}.')
+
+def prep_pkginfo_all_promotions(pkginfo, file, config, config_path, state_store=None, summary=None, evaluators=None, missing_edit_dates=None):
+	# returns the record of the first promotion the item is eligible for, or None. evaluators is {path: function to
+	# re-evaluate the item with if it changed after it was read}
+	promotions = config["promotions"]
+	for promotion in promotions:
+		promote_to, promote_from, days, custom_items = get_promotion_info(promotion, promotions, config, config_path)
+		is_eligible, item_promo_info = prep_item_for_promotion(pkginfo, promote_to, promote_from, days, custom_items, file, missing_edit_dates, state_store, summary=summary)
+		if is_eligible and check_selections(config, pkginfo):
+			if evaluators is not None:
+				evaluators[file] = functools.partial(reevaluate_all_promotions, item_path=file, config=config, config_path=config_path, state_store=state_store, summary=summary)
+			return (promotion, promote_to, pkginfo, item_promo_info)
+	return None
+
+def describe_records(records, promotions, excluded=None, missing_edit_dates=None):
+	# groups the items to promote and the (record, reason) of excluded items per promotion, in order of config file.
+	# missing_edit_dates are {item_path: item} of items that need the edit date the prep set for them written
 	names = dict()
 	versions = dict()
 	custom_item_descriptions = dict()
-	prepped_promotions = []
 	promote_tos = dict()
-	if config and "promotions" in config and type(config["promotions"]) == dict:
-		promotions = config["promotions"]
-		for file in get_munki_paths(munki_path):
-			try:
-				# open file
-				with open(file, "rb+") as fp:
-					try:
-						# load file
-						pkginfo = plistlib.load(fp, fmt=None)
-						# prep individual pkginfo for promotion
-						for promotion in config["promotions"]:
-							promote_to, promote_from, days, custom_items = get_promotion_info(promotion, promotions, config, config_path)
-							is_eligible, item_promo_info = prep_item_for_promotion(pkginfo, promote_to, promote_from, days, custom_items, file)
-							if is_eligible and check_selections(config, pkginfo):
-								item_name, item_version, item_promotion, custom_promote_to = item_promo_info
-								if not (promotion in names):
-									# first of this promotion type
-									names[promotion] = []
-									versions[promotion] = []
-									custom_item_descriptions[promotion] = {"names": [], "versions": [], "promote_tos": []}
-									promote_tos[promotion] = promote_to
-								if custom_promote_to:
-									if "supported_architectures" in pkginfo:
-										custom_item_descriptions[promotion]["names"].append(item_name + f" ({', '.join(pkginfo['supported_architectures'])})")
-									else:
-										custom_item_descriptions[promotion]["names"].append(item_name)
-									custom_item_descriptions[promotion]["versions"].append(item_version)
-									custom_item_descriptions[promotion]["promote_tos"].append(custom_promote_to)
-								else:
-									if "supported_architectures" in pkginfo:
-										names[promotion].append(item_name + f" ({', '.join(pkginfo['supported_architectures'])})")
-									else:
-										names[promotion].append(item_name)
-									versions[promotion].append(item_version)
-								prepped_promotions.append(item_promotion)
-								break
-					except plistlib.InvalidFileException as e:
-						logging.error(f"Could not load file {file} in munki directory.")
-						logging.error(e, exc_info=True)
-						sys.exit(1)
-			except OSError as e:
-				logging.error(f"Could not open file {file} in munki directory.")
-				logging.error(e, exc_info=True)
-				sys.exit(1)
-		return names, versions, custom_item_descriptions, prepped_promotions, promote_tos
+	for promotion, promote_to, pkginfo, item_promo_info in records:
+		add_promotion_description(names, versions, custom_item_descriptions, promote_tos, promotion, promote_to, pkginfo, item_promo_info)
+	excluded_items = dict()
+	for (promotion, promote_to, pkginfo, item_promo_info), reason in excluded or []:
+		item_name, item_version, (item_path, _), _ = item_promo_info
+		if "supported_architectures" in pkginfo:
+			item_name += f" ({', '.join(pkginfo['supported_architectures'])})"
+		promote_tos.setdefault(promotion, promote_to)
+		excluded_items.setdefault(promotion, []).append({"name": item_name, "version": item_version, "path": item_path, "reason": reason})
+	described = []
+	for promotion in promotions:
+		if promotion in promote_tos:
+			described.append({
+				"promotion": promotion,
+				"promote_to": promote_tos[promotion],
+				"names": names.get(promotion, []),
+				"versions": versions.get(promotion, []),
+				"custom_item_descriptions": custom_item_descriptions.get(promotion, {"names": [], "versions": [], "promote_tos": []}),
+				"excluded": excluded_items.get(promotion, []),
+			})
+	return {
+		"promotions": described,
+		"items": [item_promo_info[2] for _, _, _, item_promo_info in records],
+		"records": records,
+		"excluded": excluded or [],
+		"missing_edit_dates": list((missing_edit_dates or dict()).items()),
+	}
+
+def add_promotion_description(names, versions, custom_item_descriptions, promote_tos, promotion, promote_to, pkginfo, item_promo_info):
+	item_name, item_version, _, custom_promote_to = item_promo_info
+	if not (promotion in names):
+		# first of this promotion type
+		names[promotion] = []
+		versions[promotion] = []
+		custom_item_descriptions[promotion] = {"names": [], "versions": [], "promote_tos": []}
+		promote_tos[promotion] = promote_to
+	if custom_promote_to:
+		if "supported_architectures" in pkginfo:
+			custom_item_descriptions[promotion]["names"].append(item_name + f" ({', '.join(pkginfo['supported_architectures'])})")
+		else:
+			custom_item_descriptions[promotion]["names"].append(item_name)
+		custom_item_descriptions[promotion]["versions"].append(item_version)
+		custom_item_descriptions[promotion]["promote_tos"].append(custom_promote_to)
 	else:
-		# error: bad yaml config
-		logging.error(f'No promotions are currently defined in {config_path}.')
-		sys.exit(1)
+		if "supported_architectures" in pkginfo:
+			names[promotion].append(item_name + f" ({', '.join(pkginfo['supported_architectures'])})")
+		else:
+			names[promotion].append(item_name)
+		versions[promotion].append(item_version)
 
-def prep_single_promotion(promotion, config, munki_path, config_path):
+def prep_single_promotion(promotion, config, storage, config_path, state_store=None, pkgsinfo=None, summary=None, evaluators=None, missing_edit_dates=None):
 	if config and "promotions" in config and type(config["promotions"]) == dict:
 		promotions = config["promotions"]
 		if does_promotion_exist(promotion, promotions):
 			promote_to, promote_from, days, custom_items = get_promotion_info(promotion, promotions, config, config_path)
-			names, version, custom_item_descriptions, promotions = prep_pkgsinfo_single_promotion(promote_to, promote_from, days, custom_items, munki_path, config)
-			return names, version, custom_item_descriptions, promotions, promote_to
+			return [(promotion, promote_to, pkginfo, item_promo_info) for pkginfo, item_promo_info in prep_pkgsinfo_single_promotion(promotion, promote_to, promote_from, days, custom_items, storage, config, state_store, pkgsinfo, summary, evaluators, missing_edit_dates)]
 		else:
 			# error: catalog does not exist
-			logging.error(f'Promotion "{promotion}" not found! Use --list to see valid catalogs to promote. Promotions can be configured in {config_path}.')
-			sys.exit(1)
+			raise PromoterError(f'Promotion "{promotion}" not found! Use --list to see valid catalogs to promote. Promotions can be configured in {config_path}.')
 	else:
 		# error: bad yaml config
-		logging.error(f'No promotions are currently defined in {config_path}.')
-		sys.exit(1)
+		raise PromoterError(f'No promotions are currently defined in {config_path}.')
 
-def prep_pkgsinfo_single_promotion(promote_to, promote_from, days, custom_items, munki_path, config):
-	names = []
-	versions = []
-	promotions = []
-	custom_item_descriptions = {"names": [], "versions": [], "promote_tos": []}
-	for file in get_munki_paths(munki_path):
-		try:
-			# open file
-			with open(file, "rb+") as fp:
-				try:
-					# load file
-					pkginfo = plistlib.load(fp, fmt=None)
-					# prep individual pkginfo for promotion
-					is_eligible, item_promo_info = prep_item_for_promotion(pkginfo, promote_to, promote_from, days, custom_items, file)
-					if is_eligible and check_selections(config, pkginfo):
-						item_name, item_version, item_promotion, custom_promote_to = item_promo_info
-						if custom_promote_to:
-							if "supported_architectures" in pkginfo:
-								custom_item_descriptions["names"].append(item_name + f" ({', '.join(pkginfo['supported_architectures'])})")
-							else:
-								custom_item_descriptions["names"].append(item_name)
-							custom_item_descriptions["versions"].append(item_version)
-							custom_item_descriptions["promote_tos"].append(custom_promote_to)
-						else:
-							if "supported_architectures" in pkginfo:
-								names.append(item_name + f" ({', '.join(pkginfo['supported_architectures'])})")
-							else:
-								names.append(item_name)
-							versions.append(item_version)
-						promotions.append(item_promotion)
-				except plistlib.InvalidFileException as e:
-					logging.error(f"Could not load file {file} in munki directory.")
-					logging.error(e, exc_info=True)
-					sys.exit(1)
-		except OSError as e:
-			logging.error(f"Could not open file {file} in munki directory.")
-			logging.error(e, exc_info=True)
-			sys.exit(1)
-	return names, versions, custom_item_descriptions, promotions
+def prep_pkgsinfo_single_promotion(promotion, promote_to, promote_from, days, custom_items, storage, config, state_store=None, pkgsinfo=None, summary=None, evaluators=None, missing_edit_dates=None):
+	if pkgsinfo is None:
+		pkgsinfo = read_pkgsinfo(storage)
+	eligible = []
+	for file, pkginfo in pkgsinfo:
+		# prep individual pkginfo for promotion
+		is_eligible, item_promo_info = prep_item_for_promotion(pkginfo, promote_to, promote_from, days, custom_items, file, missing_edit_dates, state_store, summary=summary)
+		if is_eligible and check_selections(config, pkginfo):
+			eligible.append((pkginfo, item_promo_info))
+			if evaluators is not None:
+				evaluators[file] = functools.partial(reevaluate_single_promotion, item_path=file, promotion=promotion, promote_to=promote_to, promote_from=promote_from, days=days, custom_items=custom_items, config=config, state_store=state_store, summary=summary)
+	return eligible
 
-def prep_item_for_promotion(item, promote_to, promote_from, days, custom_items, item_path):
+def get_item_promotion_rules(item_name, promote_to, promote_from, days, custom_items):
 	changed_promote_to = False
-	try:		
-		item_name = item["name"]
-		item_version = item["version"]
-		item_catalogs = item["catalogs"]
-	except:
-		logging.error(f"File {item_path} is missing expected keys.", exc_info=True)
-		sys.exit(1)
 	# check if custom item
 	if item_name in custom_items and type(custom_items[item_name]) == dict:
 		if "days_in_catalog" in custom_items[item_name]:
@@ -610,125 +633,165 @@ def prep_item_for_promotion(item, promote_to, promote_from, days, custom_items,
 			changed_promote_to = True
 		if "promote_from" in custom_items[item_name] and type(custom_items[item_name]["promote_from"]) == list and len(custom_items[item_name]["promote_from"]) > 0:
 			promote_from = custom_items[item_name]["promote_from"]
+	return promote_to, promote_from, days, changed_promote_to
+
+def prep_item_for_promotion(item, promote_to, promote_from, days, custom_items, item_path, missing_edit_dates=None, state_store=None, today=None, summary=None):
+	try:		
+		item_name = item["name"]
+		item_version = item["version"]
+		item_catalogs = item["catalogs"]
+	except Exception as e:
+		raise PromoterError(f"File {item_path} is missing expected keys.") from e
+	promote_to, promote_from, days, changed_promote_to = get_item_promotion_rules(item_name, promote_to, promote_from, days, custom_items)
 	# check if eligable for promotion based on current catalogs
 	if set(item_catalogs) == set(promote_from): # convert to set so order doesn't matter
 		# check if eligable for promotion based on days
-		today = datetime.datetime.now()
-		last_edited_date = today
-		if "_metadata" in item:
-			if "munki-promoter_edit_date" in item["_metadata"]:
-				last_edited_date = item["_metadata"]["munki-promoter_edit_date"]
-			elif "creation_date" in item["_metadata"]:
+		if not today:
+			today = datetime.datetime.now()
+		last_edited_date = get_edit_date(item, item_path, state_store)
+		if not last_edited_date:
+			if "_metadata" in item and "creation_date" in item["_metadata"]:
 				last_edited_date = item["_metadata"]["creation_date"]
-				logging.info(f"File {item_path} is missing a last edit date so the creation date {last_edited_date} will be used with the assumption that this item has been in the current catalog(s) since creation.")
+				logging.debug(f"File {item_path} is missing a last edit date so the creation date {last_edited_date} will be used with the assumption that this item has been in the current catalog(s) since creation.")
+				add_to_summary(summary, "creation_date", item_path)
 			else:
-				item["_metadata"]["munki-promoter_edit_date"] = today
-				logging.info(f"File {item_path} is missing a creation date so munki-promoter will set the last edit date to today.")
-				try_add_metadata(item_path, item)
-		else:
-			item["_metadata"] = {"munki-promoter_edit_date": today}
-			logging.info(f"File {item_path} is missing a creation date so munki-promoter will set the last edit date to today.")
-			try_add_metadata(item_path, item)
+				last_edited_date = today
+				logging.debug(f"File {item_path} is missing a creation date so munki-promoter will set the last edit date to today.")
+				add_to_summary(summary, "edit_date_set", item_path)
+				set_missing_edit_date(missing_edit_dates, item_path, item, today)
 		if last_edited_date + datetime.timedelta(days=days) < today:
 			# up for promotion!
 			item["catalogs"] = promote_to
-			item["_metadata"]["munki-promoter_edit_date"] = today
+			if not state_store:
+				# with a state store the edit date is recorded once the item has been written
+				item["_metadata"]["munki-promoter_edit_date"] = today
 			if changed_promote_to:
 				return True, (item_name, item_version, (item_path, item), promote_to)
 			else:
 				return True, (item_name, item_version, (item_path, item), None)
 	return False, None
 
-def promote_items(preped_promotions):
-	for item_path, item in preped_promotions:
+def promote_items(storage, records, state_store=None, journal=None, summary=None, evaluators=None):
+	# returns (records that were written, paths that were skipped because another process changed or locked them). Items
+	# that were re-evaluated are returned with the record they were written with
+	promoted = []
+	skipped = []
+	for record in records:
+		item_path, item = record[3][2]
 		try:
-			# open file
-			with open(item_path, "rb+") as fp:
-				try:
-					logging.info(f"Promoting {item_path} to {item['catalogs']}")
-					# make sure we are at start of file
-					fp.seek(0)
-					# write to file
-					plistlib.dump(item, fp, fmt=plistlib.FMT_XML)
-					# remove any excess of old file
-					fp.truncate()
-				except Exception as e:
-					logging.error(f"Could not write to file {item_path} in munki directory.")
-					logging.error(e, exc_info=True)
-					sys.exit(1)
-		except OSError as e:
-			logging.error(f"Could not open file {item_path} in munki directory.")
-			logging.error(e, exc_info=True)
-			sys.exit(1)
+			logging.debug(f"Promoting {item_path} to {item['catalogs']}")
+			record = write_record(storage, record, summary, evaluators)
+			if not record:
+				skipped.append(item_path)
+				if journal:
+					journal.mark(item_path, "skipped")
+				continue
+			promoted.append(record)
+			add_to_summary(summary, "promoted", item_path)
+			if state_store:
+				state_store.set_edit_date(item_path, record[3][2][1], journal.today if journal else datetime.datetime.now())
+			if journal:
+				journal.mark(item_path, "done")
+		except StorageError as e:
+			raise PromoterError(f"Could not write to file {item_path} in munki directory.") from e
+	if state_store:
+		state_store.commit()
+	return promoted, skipped
+
+def write_record(storage, record, summary=None, evaluators=None):
+	# writes the item of a record, returns the record that was written or None if the item was skipped
+	item_path, item = record[3][2]
+	reevaluated = dict()
+	if evaluators and item_path in evaluators:
+		evaluators = {item_path: functools.partial(reevaluate_record, evaluators[item_path], reevaluated)}
+	if not write_item(storage, item_path, item, summary, evaluators):
+		return None
+	return reevaluated.get("record", record)
 
-def try_add_metadata(item_path, item):
+def try_add_metadata(storage, item_path, item, summary=None, evaluators=None):
 	try:
-		# open file
-		with open(item_path, "rb+") as fp:
-			try:
-				logging.info(f"Adding missing metadata to file {item_path}")
-				# make sure we are at start of file
-				fp.seek(0)
-				# write to file
-				plistlib.dump(item, fp, fmt=plistlib.FMT_XML)
-				# remove any excess of old file
-				fp.truncate()
-			except:
-				logging.warning(f"File {item_path} is missing metadata and this file can not be written to.", exc_info=True)
-	except OSError:
-			logging.warning(f"File {item_path} is missing metadata and this file can not be written to.", exc_info=True)
+		logging.debug(f"Adding missing metadata to file {item_path}")
+		if write_item(storage, item_path, item, summary, evaluators):
+			add_to_summary(summary, "metadata_added", item_path)
+			return True
+	except StorageError:
+		logging.warning(f"File {item_path} is missing metadata and this file can not be written to.", exc_info=True)
+	return False
+
+def set_missing_edit_date(missing_edit_dates, item_path, item, today):
+	# only sets the date in memory, so preparing a promotion changes nothing. Items in missing_edit_dates get their date
+	# written when the promotions are applied, without it (e.g. when simulating) it is not kept
+	if not "_metadata" in item:
+		item["_metadata"] = dict()
+	item["_metadata"]["munki-promoter_edit_date"] = today
+	if missing_edit_dates is not None:
+		# a copy, as the catalogs of the item may still be changed in memory by later promotions
+		missing_edit_dates[item_path] = copy.deepcopy(item)
+
+def record_missing_edit_dates(storage, missing_edit_dates, state_store=None, summary=None, journal=None):
+	# writes the edit dates set by set_missing_edit_date, missing_edit_dates are (item_path, item)
+	for item_path, item in missing_edit_dates:
+		is_applied = apply_edit_date(storage, state_store, item_path, item, summary)
+		if journal:
+			journal.mark(item_path, "done" if is_applied else "skipped")
+	if state_store:
+		state_store.commit()
+
+def apply_edit_date(storage, state_store, item_path, item, summary=None, evaluators=None):
+	# records the edit date set in the item's metadata
+	if state_store:
+		state_store.set_edit_date(item_path, item, item["_metadata"]["munki-promoter_edit_date"])
+		return True
+	return try_add_metadata(storage, item_path, item, summary, evaluators)
 
-def prep_set_edit_date(munki_path, config, overwrite=False, promotion=None, promote_from_days=None, config_path=None):
+def get_edit_date(item, item_path, state_store):
+	# returns the last edit date of the item, or None if it is unknown
+	if state_store:
+		edit_date = state_store.get_edit_date(item_path, item)
+		if edit_date:
+			return edit_date
+	if "_metadata" in item and "munki-promoter_edit_date" in item["_metadata"]:
+		return item["_metadata"]["munki-promoter_edit_date"]
+	return None
+
+def prep_set_edit_date(storage, config, overwrite=False, promotion=None, promote_from_days=None, config_path=None, state_store=None, pkgsinfo=None, summary=None, evaluators=None):
 	if promotion:
 		if config and "promotions" in config and type(config["promotions"]) == dict:
 			promotions = config["promotions"]
 			if does_promotion_exist(promotion, promotions):
 				_, promote_from, _, custom_items = get_promotion_info(promotion, promotions, config, config_path)
-				return prep_pkgsinfo_edit_date(munki_path, config, promote_from=promote_from, promote_from_days=promote_from_days, custom_items=custom_items) 
+				return prep_pkgsinfo_edit_date(storage, config, promote_from=promote_from, promote_from_days=promote_from_days, custom_items=custom_items, state_store=state_store, pkgsinfo=pkgsinfo, summary=summary, evaluators=evaluators)
 			else:
 				# error: catalog does not exist
-				logging.error(f'Promotion "{promotion}" not found! Use --list to see valid catalogs to promote. Promotions can be configured in {config_path}.')
-				sys.exit(1)
+				raise PromoterError(f'Promotion "{promotion}" not found! Use --list to see valid catalogs to promote. Promotions can be configured in {config_path}.')
 		else:
 			# error: bad yaml config
-			logging.error(f'No promotions are currently defined in {config_path}.')
-			sys.exit(1)
+			raise PromoterError(f'No promotions are currently defined in {config_path}.')
 	else:
-		return prep_pkgsinfo_edit_date(munki_path, config, overwrite=overwrite)
+		return prep_pkgsinfo_edit_date(storage, config, overwrite=overwrite, state_store=state_store, pkgsinfo=pkgsinfo, summary=summary, evaluators=evaluators)
 
-def prep_pkgsinfo_edit_date(munki_path, config, overwrite=False, promote_from=None, promote_from_days=None, custom_items=None):
+def prep_pkgsinfo_edit_date(storage, config, overwrite=False, promote_from=None, promote_from_days=None, custom_items=None, state_store=None, pkgsinfo=None, summary=None, evaluators=None):
+	if pkgsinfo is None:
+		pkgsinfo = read_pkgsinfo(storage)
 	names = []
 	changes = []
-	for file in get_munki_paths(munki_path):
-		try:
-			# open file
-			with open(file, "rb+") as fp:
-				try:
-					# load file
-					pkginfo = plistlib.load(fp, fmt=None)
-					# prep individual pkginfo for promotion
-					item_name, item = prep_item_edit_date(pkginfo, file, overwrite, promote_from, promote_from_days, custom_items)
-					if item_name and check_selections(config, pkginfo): 
-						names.append(item_name)
-						changes.append(item)
-				except plistlib.InvalidFileException as e:
-					logging.error(f"Could not load file {file} in munki directory.")
-					logging.error(e, exc_info=True)
-					sys.exit(1)
-		except OSError as e:
-			logging.error(f"Could not open file {file} in munki directory.")
-			logging.error(e, exc_info=True)
-			sys.exit(1)
+	for file, pkginfo in pkgsinfo:
+		# prep individual pkginfo for promotion
+		item_name, item = prep_item_edit_date(pkginfo, file, overwrite, promote_from, promote_from_days, custom_items, state_store, summary)
+		if item_name and check_selections(config, pkginfo): 
+			names.append(item_name)
+			changes.append(item)
+			if evaluators is not None:
+				evaluators[file] = functools.partial(reevaluate_edit_date, item_path=file, config=config, overwrite=overwrite, promote_from=promote_from, promote_from_days=promote_from_days, custom_items=custom_items, state_store=state_store, summary=summary)
 	return names, changes
 
-def prep_item_edit_date(item, item_path, overwrite, promote_from, promote_from_days, custom_items):
+def prep_item_edit_date(item, item_path, overwrite, promote_from, promote_from_days, custom_items, state_store=None, summary=None):
 	try:
 		item_name = item["name"]
 		if promote_from:
 			item_catalogs = item["catalogs"]
-	except:
-		logging.error(f"File {item_path} is missing expected keys.", exc_info=True)
-		sys.exit(1)
+	except Exception as e:
+		raise PromoterError(f"File {item_path} is missing expected keys.") from e
 	# if for a specific promotion, check if custom item
 	if promote_from and (item_name in custom_items and type(custom_items[item_name]) == dict):
 		if "promote_from" in custom_items[item_name] and type(custom_items[item_name]["promote_from"]) == list and len(custom_items[item_name]["promote_from"]) > 0:
@@ -736,12 +799,13 @@ def prep_item_edit_date(item, item_path, overwrite, promote_from, promote_from_d
 	# check if overwriting or if value missing
 	if not "_metadata" in item:
 		item["_metadata"] = dict()
-	if overwrite or (not "munki-promoter_edit_date" in item["_metadata"]):
+	if overwrite or not get_edit_date(item, item_path, state_store):
 		today = datetime.datetime.now()
 		if promote_from:
 			if set(item_catalogs) == set(promote_from):
 				if not "creation_date" in item["_metadata"]:
-					logging.info(f"File {item_path} is missing a creation date so munki-promoter will set the last edit date to today.")
+					logging.debug(f"File {item_path} is missing a creation date so munki-promoter will set the last edit date to today.")
+					add_to_summary(summary, "edit_date_set", item_path)
 					item["_metadata"]["munki-promoter_edit_date"] = today
 					return item_name, (item_path, item)
 				else:
@@ -778,14 +842,1569 @@ def check_selection(selection, item):
 		# key not in item
 		return True
 	# wrong type
-	logging.error(f"Encountered invalid type {selection['type']} in selection.")
-	sys.exit(1)
+	raise PromoterError(f"Encountered invalid type {selection['type']} in selection.")
 
 
+# ----------------------------------------
+#          Vectorised evaluation
+# ----------------------------------------
+def import_numpy():
+	try:
+		global np
+		import numpy as np
+	except ImportError:
+		raise PromoterError("NumPy library could not be loaded, it is needed for vectorised evaluation. You can install the optional dependencies with 'python3 -m pip install -r requirements-extras.txt'")
+
+def to_epoch(date):
+	# microseconds since the epoch, so dates compare exactly like datetimes
+	return (date - EPOCH) // datetime.timedelta(microseconds=1)
+
+def build_item_table(items, config):
+	# one column per property that decides eligibility, one row per pkginfo file
+	catalog_set_ids = dict()
+	name_ids = dict()
+	selections = config.get("selections", [])
+	table = {
+		"catalog_set": np.empty(len(items), dtype=np.int64),
+		"name": np.empty(len(items), dtype=np.int64),
+		"edit_date": np.zeros(len(items), dtype=np.int64),
+		"has_edit_date": np.zeros(len(items), dtype=bool),
+		"creation_date": np.zeros(len(items), dtype=np.int64),
+		"has_creation_date": np.zeros(len(items), dtype=bool),
+		"selections": np.ones((len(items), len(selections)), dtype=bool),
+	}
+	for i, (item_path, item, edit_date) in enumerate(items):
+		table["catalog_set"][i] = catalog_set_ids.setdefault(frozenset(item["catalogs"]), len(catalog_set_ids))
+		table["name"][i] = name_ids.setdefault(item["name"], len(name_ids))
+		if edit_date:
+			table["edit_date"][i] = to_epoch(edit_date)
+			table["has_edit_date"][i] = True
+		if "_metadata" in item and "creation_date" in item["_metadata"]:
+			table["creation_date"][i] = to_epoch(item["_metadata"]["creation_date"])
+			table["has_creation_date"][i] = True
+		for j, selection in enumerate(selections):
+			table["selections"][i, j] = check_selection(selection, item)
+	return table, catalog_set_ids, name_ids
+
+def evaluate_promotions(table, catalog_set_ids, name_ids, rules, paths, today, state_store=None, summary=None):
+	# returns for each item the index of the first rule it is eligible for (or -1), and which items need a last edit date
+	now = to_epoch(today)
+	count = len(table["catalog_set"])
+	promotion_index = np.full(count, -1, dtype=np.int64)
+	pending = np.ones(count, dtype=bool)
+	missing_edit_date = np.zeros(count, dtype=bool)
+	selected = table["selections"].all(axis=1)
+	for index, (promote_to, promote_from, days, custom_items) in enumerate(rules):
+		if not pending.any():
+			break
+		# per item thresholds, custom items can override those of the promotion
+		from_ids = np.full(count, catalog_set_ids.get(frozenset(promote_from), -1), dtype=np.int64)
+		to_ids = np.full(count, catalog_set_ids.setdefault(frozenset(promote_to), len(catalog_set_ids)), dtype=np.int64)
+		day_counts = np.full(count, days, dtype=np.int64)
+		for name in custom_items:
+			if name in name_ids:
+				item_promote_to, item_promote_from, item_days, _ = get_item_promotion_rules(name, promote_to, promote_from, days, custom_items)
+				rows = table["name"] == name_ids[name]
+				from_ids[rows] = catalog_set_ids.get(frozenset(item_promote_from), -1)
+				to_ids[rows] = catalog_set_ids.setdefault(frozenset(item_promote_to), len(catalog_set_ids))
+				day_counts[rows] = item_days
+		matches = pending & (table["catalog_set"] == from_ids)
+		from_creation_date = matches & ~table["has_edit_date"] & table["has_creation_date"]
+		for i in np.nonzero(from_creation_date)[0]:
+			logging.debug(f"File {paths[i]} is missing a last edit date so the creation date {EPOCH + datetime.timedelta(microseconds=int(table['creation_date'][i]))} will be used with the assumption that this item has been in the current catalog(s) since creation.")
+			add_to_summary(summary, "creation_date", paths[i])
+		no_date = matches & ~table["has_edit_date"] & ~table["has_creation_date"]
+		missing_edit_date |= no_date
+		table["edit_date"][no_date] = now
+		table["has_edit_date"][no_date] = True
+		last_edited_date = np.where(table["has_edit_date"], table["edit_date"], table["creation_date"])
+		eligible = matches & (last_edited_date + day_counts * DAY_IN_MICROSECONDS < now)
+		promotion_index[eligible & selected] = index
+		pending &= ~(eligible & selected)
+		# items left out by selections still have their catalogs changed in memory, like prep_item_for_promotion does
+		left_out = eligible & ~selected
+		table["catalog_set"][left_out] = to_ids[left_out]
+		if not state_store:
+			table["edit_date"][left_out] = now
+			table["has_edit_date"][left_out] = True
+	return promotion_index, missing_edit_date
+
+def check_vectorised_selections(config, config_path):
+	# selections are evaluated once per item on the item as read, so they can't depend on what the promotions change
+	for selection in config.get("selections", []):
+		if selection["key"] in ["catalogs", "munki-promoter_edit_date"]:
+			raise PromoterError(f'Selections on "{selection["key"]}" in {config_path} are not supported by the vectorised evaluation, as it changes while items are promoted.')
+
+def prep_all_promotions_vectorised(config, storage, config_path, state_store=None, pkgsinfo=None, summary=None, evaluators=None, missing_edit_dates=None):
+	import_numpy()
+	if config:
+		check_vectorised_selections(config, config_path)
+	if pkgsinfo is None:
+		pkgsinfo = read_pkgsinfo(storage)
+	records = []
+	if config and "promotions" in config and type(config["promotions"]) == dict:
+		promotions = config["promotions"]
+		items = []
+		for file, pkginfo in pkgsinfo:
+			if not ("name" in pkginfo and "version" in pkginfo and "catalogs" in pkginfo):
+				raise PromoterError(f"File {file} is missing expected keys.")
+			items.append((file, pkginfo, get_edit_date(pkginfo, file, state_store)))
+		if not items:
+			return records
+		rules = [get_promotion_info(promotion, promotions, config, config_path) for promotion in promotions]
+		table, catalog_set_ids, name_ids = build_item_table(items, config)
+		today = datetime.datetime.now()
+		paths = [file for file, _, _ in items]
+		promotion_index, missing_edit_date = evaluate_promotions(table, catalog_set_ids, name_ids, rules, paths, today, state_store, summary)
+		for i in np.nonzero(missing_edit_date)[0]:
+			file, pkginfo, _ = items[i]
+			logging.debug(f"File {file} is missing a creation date so munki-promoter will set the last edit date to today.")
+			add_to_summary(summary, "edit_date_set", file)
+			set_missing_edit_date(missing_edit_dates, file, pkginfo, today)
+		# collect results in file order, like prep_all_promotions
+		promotion_names = list(promotions)
+		for i in np.nonzero(promotion_index >= 0)[0]:
+			file, pkginfo, _ = items[i]
+			promotion = promotion_names[promotion_index[i]]
+			promote_to, promote_from, days, custom_items = rules[promotion_index[i]]
+			item_promote_to, _, _, changed_promote_to = get_item_promotion_rules(pkginfo["name"], promote_to, promote_from, days, custom_items)
+			pkginfo["catalogs"] = item_promote_to
+			if not state_store:
+				pkginfo["_metadata"]["munki-promoter_edit_date"] = today
+			item_promo_info = (pkginfo["name"], pkginfo["version"], (file, pkginfo), item_promote_to if changed_promote_to else None)
+			records.append((promotion, promote_to, pkginfo, item_promo_info))
+			if evaluators is not None:
+				evaluators[file] = functools.partial(reevaluate_all_promotions, item_path=file, config=config, config_path=config_path, state_store=state_store, summary=summary)
+		return records
+	else:
+		# error: bad yaml config
+		raise PromoterError(f'No promotions are currently defined in {config_path}.')
+
+# ----------------------------------------
+#              Simulation
+# ----------------------------------------
+def simulate_promotions(config, storage, config_path, days_to_simulate, promotion=None, state_store=None, pkgsinfo=None, summary=None):
+	# returns what would be promoted by a run on each of the coming days, reading the repo only once
+	if not (config and "promotions" in config and type(config["promotions"]) == dict):
+		# error: bad yaml config
+		raise PromoterError(f'No promotions are currently defined in {config_path}.')
+	promotions = config["promotions"]
+	if promotion and not does_promotion_exist(promotion, promotions):
+		# error: catalog does not exist
+		raise PromoterError(f'Promotion "{promotion}" not found! Use --list to see valid catalogs to promote. Promotions can be configured in {config_path}.')
+	rules = [(name,) + get_promotion_info(name, promotions, config, config_path) for name in ([promotion] if promotion else promotions)]
+	if pkgsinfo is None:
+		pkgsinfo = read_pkgsinfo(storage)
+	start = datetime.datetime.now()
+	items = []
+	stamped = set()
+	for file, pkginfo in pkgsinfo:
+		if not ("name" in pkginfo and "version" in pkginfo and "catalogs" in pkginfo):
+			raise PromoterError(f"File {file} is missing expected keys.")
+		# keep the last edit date in memory, a run today would set missing ones to today
+		edit_date = get_edit_date(pkginfo, file, state_store)
+		if not "_metadata" in pkginfo:
+			pkginfo["_metadata"] = dict()
+		if edit_date:
+			pkginfo["_metadata"]["munki-promoter_edit_date"] = edit_date
+		elif not "creation_date" in pkginfo["_metadata"]:
+			pkginfo["_metadata"]["munki-promoter_edit_date"] = start
+			stamped.add(len(items))
+		items.append((file, pkginfo))
+	schedule = [{"day": day, "date": (start + datetime.timedelta(days=day)).date().isoformat(), "promotions": []} for day in range(days_to_simulate + 1)]
+	# events are (day, index of item), so items promoted on the same day stay in file order
+	queue = []
+	for index, (_, pkginfo) in enumerate(items):
+		day = get_next_promotion_day(pkginfo, rules, start, 0)
+		if day != 0 and index in stamped:
+			# a run today only has the date it set in memory, later runs read it back from the pkgsinfo file
+			pkginfo["_metadata"]["munki-promoter_edit_date"] = stored_date(start, state_store)
+			day = get_next_promotion_day(pkginfo, rules, start, 1)
+		if day is not None and day <= days_to_simulate:
+			heapq.heappush(queue, (day, index))
+	while queue:
+		day, index = heapq.heappop(queue)
+		file, pkginfo = items[index]
+		# run the same checks as prep_all_promotions would on that day, on a copy as nothing is written unless promoted
+		item = copy.deepcopy(pkginfo)
+		for name, promote_to, promote_from, days, custom_items in rules:
+			is_eligible, item_promo_info = prep_item_for_promotion(item, promote_to, promote_from, days, custom_items, file, today=start + datetime.timedelta(days=day), summary=summary)
+			if is_eligible and check_selections(config, item):
+				item_name, item_version, _, _ = item_promo_info
+				schedule[day]["promotions"].append({"promotion": name, "name": item_name, "version": item_version, "path": file, "promote_to": item["catalogs"]})
+				item["_metadata"]["munki-promoter_edit_date"] = stored_date(item["_metadata"]["munki-promoter_edit_date"], state_store)
+				items[index] = (file, item)
+				pkginfo = item
+				break
+		# the next run is the day after, items that were not promoted (e.g. left out by the selections) are tried again too
+		day = get_next_promotion_day(pkginfo, rules, start, day + 1)
+		if day is not None and day <= days_to_simulate:
+			heapq.heappush(queue, (day, index))
+	return schedule
+
+def get_next_promotion_day(pkginfo, rules, start, first_day):
+	# the first day from first_day on that any of the rules could promote the item, or None
+	next_day = None
+	for _, promote_to, promote_from, days, custom_items in rules:
+		_, item_promote_from, item_days, _ = get_item_promotion_rules(pkginfo["name"], promote_to, promote_from, days, custom_items)
+		if set(pkginfo["catalogs"]) == set(item_promote_from):
+			metadata = pkginfo["_metadata"]
+			last_edited_date = metadata.get("munki-promoter_edit_date", metadata.get("creation_date"))
+			# the first run strictly after last_edited_date + days
+			day = max((last_edited_date + datetime.timedelta(days=item_days) - start) // datetime.timedelta(days=1) + 1, first_day)
+			if next_day is None or day < next_day:
+				next_day = day
+	return next_day
+
+def stored_date(date, state_store):
+	# pkgsinfo files only keep dates to the second, which decides on which day an item becomes eligible
+	if state_store:
+		return date
+	return date.replace(microsecond=0)
+
+def describe_simulation(schedule):
+	result = ""
+	for day in schedule:
+		if len(day["promotions"]) > 0:
+			result += f"\n{day['date']} (day {day['day']}):\n"
+			promotions = white_space_pad_strings([promotion["promotion"] for promotion in day["promotions"]])
+			names = white_space_pad_strings([f"{promotion['name']} - {promotion['version']}" for promotion in day["promotions"]])
+			for i, promotion in enumerate(day["promotions"]):
+				result += f"  {promotions[i]} : {names[i]} -> {and_str(promotion['promote_to'])}\n"
+	if not result:
+		result = f"\nNo items would be promoted in the coming {len(schedule) - 1} days.\n"
+	return result
+
+# ----------------------------------------
+#              Concurrency
+# ----------------------------------------
+def acquire_lock(fp, exclusive=True, retries=LOCK_RETRIES):
+	operation = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+	for attempt in range(retries):
+		try:
+			fcntl.lockf(fp, operation | fcntl.LOCK_NB)
+			return True
+		except OSError:
+			time.sleep(LOCK_RETRY_DELAY * (attempt + 1))
+	return False
+
+def write_item(storage, item_path, item, summary=None, evaluators=None):
+	# returns the item that was written, or None if it was skipped because another process changed or locked it. Items
+	# that changed are re-evaluated with their function in evaluators, if they have one
+	for attempt in range(LOCK_RETRIES):
+		try:
+			storage.write_item(item_path, plistlib.dumps(item, fmt=plistlib.FMT_XML))
+			return item
+		except StorageLockedError:
+			logging.warning(f"File {item_path} is locked by another process and will be skipped.")
+			return None
+		except WriteConflictError:
+			if not (evaluators and item_path in evaluators):
+				logging.warning(f"File {item_path} was changed by another process since it was read and will be skipped.")
+				return None
+			# re-evaluate just this item against its current content
+			logging.debug(f"File {item_path} was changed by another process since it was read, re-evaluating it.")
+			add_to_summary(summary, "reevaluated", item_path)
+			item = evaluators[item_path](plistlib.loads(storage.read_item(item_path)))
+			if not item:
+				logging.warning(f"File {item_path} is no longer eligible after being changed by another process and will be skipped.")
+				return None
+	logging.warning(f"File {item_path} kept being changed by another process and will be skipped.")
+	return None
+
+def reevaluate_single_promotion(pkginfo, item_path, promotion, promote_to, promote_from, days, custom_items, config, state_store=None, summary=None):
+	# returns the new record of the item, or None if it is no longer eligible. An item that lost its edit date is not
+	# eligible today, the next run records the missing date
+	is_eligible, item_promo_info = prep_item_for_promotion(pkginfo, promote_to, promote_from, days, custom_items, item_path, state_store=state_store, summary=summary)
+	if is_eligible and check_selections(config, pkginfo):
+		return (promotion, promote_to, pkginfo, item_promo_info)
+	return None
+
+def reevaluate_all_promotions(pkginfo, item_path, config, config_path, state_store=None, summary=None):
+	# the item may now be eligible for a different promotion
+	return prep_pkginfo_all_promotions(pkginfo, item_path, config, config_path, state_store, summary)
+
+def reevaluate_record(evaluator, reevaluated, pkginfo):
+	# promotion evaluators return a record, of which write_item only needs the item
+	reevaluated["record"] = evaluator(pkginfo)
+	if reevaluated["record"]:
+		return reevaluated["record"][3][2][1]
+	return None
+
+def reevaluate_edit_date(pkginfo, item_path, config, overwrite, promote_from, promote_from_days, custom_items, state_store=None, summary=None):
+	item_name, item_change = prep_item_edit_date(pkginfo, item_path, overwrite, promote_from, promote_from_days, custom_items, state_store, summary)
+	if item_name and check_selections(config, pkginfo):
+		_, item = item_change
+		return item
+	return None
+
+def log_skipped(skipped):
+	if skipped:
+		logging.warning(f"The following files were changed or locked by another process and have been skipped: {and_str(skipped)}")
+
+# ----------------------------------------
+#                Storage
+# ----------------------------------------
+class StorageError(PromoterError):
+	pass
+
+class WriteConflictError(StorageError):
+	# the item was changed by someone else since we read it
+	pass
+
+class StorageLockedError(StorageError):
+	# the item is locked by someone else
+	pass
+
+class LocalStorage:
+	def __init__(self, root, max_workers=READ_WORKERS):
+		self.root = root
+		self.max_workers = max_workers
+		# (mtime, size, hash) of each file as it was when we last read or wrote it
+		self.fingerprints = dict()
+		# paths written since they were last committed with git, in order of writing
+		self.written = dict()
+		self.repo_lock = None
+
+	def check_root(self):
+		if not os.path.exists(self.root):
+			raise PromoterError(f"Path to munki root directory {self.root} does not exist.")
+		if not os.access(self.root, os.W_OK):
+			raise PromoterError(f"You don't have access to {self.root}")
+
+	def list_items(self):
+		# returns (path, size, etag) of every file where file does not start with a period (hidden files)
+		self.check_root()
+		result = []
+		for root, dirs, files in os.walk(self.root):
+			for file in files:
+				if not file.startswith("."):
+					path = os.path.join(root, file)
+					stat = os.stat(path)
+					result.append((path, stat.st_size, stat.st_mtime_ns))
+		return result
+
+	def read_item(self, path):
+		try:
+			with open(path, "rb") as fp:
+				data = fp.read()
+				stat = os.fstat(fp.fileno())
+		except OSError as e:
+			raise PromoterError(f"Could not open file {path} in munki directory.") from e
+		self.fingerprints[path] = (stat.st_mtime_ns, stat.st_size, hashlib.sha256(data).hexdigest())
+		return data
+
+	def read_items(self, paths):
+		with concurrent.futures.ThreadPoolExecutor(self.max_workers) as pool:
+			yield from zip(paths, pool.map(self.read_item, paths))
+
+	def has_changed(self, fp, path):
+		if not path in self.fingerprints:
+			return False
+		mtime, size, digest = self.fingerprints[path]
+		stat = os.fstat(fp.fileno())
+		if (stat.st_mtime_ns, stat.st_size) == (mtime, size):
+			return False
+		# mtime or size differ, check whether the content actually changed
+		return hashlib.sha256(fp.read()).hexdigest() != digest
+
+	def write_item(self, path, data):
+		# only writes if the file is unchanged since we last read it
+		try:
+			with open(path, "rb+") as fp:
+				# the lock is released when the file is closed
+				if not acquire_lock(fp):
+					raise StorageLockedError(f"{path} is locked by another process.")
+				if self.has_changed(fp, path):
+					raise WriteConflictError(f"{path} was changed by another process.")
+				# make sure we are at start of file
+				fp.seek(0)
+				fp.write(data)
+				# remove any excess of old file
+				fp.truncate()
+				fp.flush()
+				stat = os.fstat(fp.fileno())
+		except OSError as e:
+			raise StorageError(f"Could not write to file {path}.") from e
+		self.fingerprints[path] = (stat.st_mtime_ns, stat.st_size, hashlib.sha256(data).hexdigest())
+		self.written[path] = True
+
+	def lock_repo(self, exclusive):
+		# every run holds a shared lock on the repo, runs that need exclusive access hold an exclusive one
+		self.check_root()
+		lock_path = self.get_lock_path()
+		try:
+			self.repo_lock = open(lock_path, "a+")
+		except OSError as e:
+			raise PromoterError(f"Could not open lock file {lock_path} of munki directory {self.root}.") from e
+		if not acquire_lock(self.repo_lock, exclusive=exclusive, retries=1):
+			logging.info(f"Waiting for another munki-promoter run to release {lock_path} ...")
+			fcntl.lockf(self.repo_lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+	def get_lock_path(self):
+		# the lock file is kept out of the repo so it never shows up as a change to commit: in the git directory when the
+		# repo is in git, otherwise in the temporary directory. It is named after the repo, as a git repo may hold several
+		root = os.path.realpath(self.root)
+		lock_file = f"munki-promoter-{hashlib.sha256(root.encode()).hexdigest()[:16]}.lock"
+		path = root
+		while True:
+			git_path = os.path.join(path, ".git")
+			if os.path.isdir(git_path):
+				return os.path.join(git_path, lock_file)
+			if os.path.isfile(git_path):
+				# worktrees and submodules have a file pointing to their git directory
+				with open(git_path) as fp:
+					content = fp.read().strip()
+				if content.startswith("gitdir:"):
+					return os.path.join(path, content[len("gitdir:"):].strip(), lock_file)
+			parent = os.path.dirname(path)
+			if parent == path:
+				return os.path.join(tempfile.gettempdir(), lock_file)
+			path = parent
+
+	def close(self):
+		if self.repo_lock:
+			self.repo_lock.close()
+			self.repo_lock = None
+
+class S3Storage:
+	def __init__(self, url, endpoint_url=None, cache_dir=None, max_workers=READ_WORKERS):
+		try:
+			global boto3
+			global botocore
+			import boto3
+			import botocore.config
+			import botocore.exceptions
+		except ImportError:
+			raise PromoterError("Boto3 library could not be loaded, it is needed for S3 storage. You can install the optional dependencies with 'python3 -m pip install -r requirements-extras.txt'")
+		parsed_url = urllib.parse.urlparse(url)
+		self.url = url
+		self.bucket = parsed_url.netloc
+		self.prefix = parsed_url.path.strip("/")
+		if self.prefix:
+			self.prefix += "/"
+		self.cache_dir = cache_dir
+		self.max_workers = max_workers
+		self.client = boto3.client("s3", endpoint_url=endpoint_url, config=botocore.config.Config(max_pool_connections=max_workers))
+		# ETag of each object as it was when we last listed, read or wrote it
+		self.etags = dict()
+		self.listed_etags = dict()
+		# the lock object or shared marker this run holds
+		self.repo_lock_key = None
+
+	def list_items(self):
+		# returns (key, size, etag) of every object where the file name does not start with a period (hidden files)
+		result = []
+		try:
+			paginator = self.client.get_paginator("list_objects_v2")
+			for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+				for obj in page.get("Contents", []):
+					file = obj["Key"].rsplit("/", 1)[-1]
+					if file and not file.startswith("."):
+						result.append((obj["Key"], obj["Size"], obj["ETag"]))
+		except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+			raise PromoterError(f"Could not list munki repo at {self.url}.") from e
+		self.listed_etags = {key: etag for key, _, etag in result}
+		return result
+
+	def get_cache_path(self, key, etag):
+		# cached objects are addressed by their ETag, so a changed object is never read from the cache
+		return os.path.join(self.cache_dir, hashlib.sha256(f"{key}\0{etag}".encode()).hexdigest())
+
+	def is_cache_file(self, file):
+		# only files named like get_cache_path are ours, anything else in the cache directory is left alone
+		return re.fullmatch(r"[0-9a-f]{64}", file) is not None
+
+	def read_item(self, key):
+		etag = self.listed_etags.get(key)
+		if self.cache_dir and etag and os.path.exists(self.get_cache_path(key, etag)):
+			with open(self.get_cache_path(key, etag), "rb") as fp:
+				self.etags[key] = etag
+				return fp.read()
+		try:
+			response = self.client.get_object(Bucket=self.bucket, Key=key)
+			data = response["Body"].read()
+		except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+			raise PromoterError(f"Could not read {key} from munki repo at {self.url}.") from e
+		self.etags[key] = response["ETag"]
+		self.write_cache(key, response["ETag"], data)
+		return data
+
+	def read_items(self, keys):
+		with concurrent.futures.ThreadPoolExecutor(self.max_workers) as pool:
+			yield from zip(keys, pool.map(self.read_item, keys))
+
+	def write_cache(self, key, etag, data):
+		if self.cache_dir:
+			os.makedirs(self.cache_dir, exist_ok=True)
+			with open(self.get_cache_path(key, etag), "wb") as fp:
+				fp.write(data)
+
+	def write_item(self, key, data):
+		# only writes if the object is unchanged since we last read it
+		kwargs = {"Bucket": self.bucket, "Key": key, "Body": data, "ContentType": "application/xml"}
+		if key in self.etags:
+			kwargs["IfMatch"] = self.etags[key]
+		try:
+			response = self.client.put_object(**kwargs)
+		except botocore.exceptions.ClientError as e:
+			if e.response["Error"]["Code"] in ["PreconditionFailed", "ConditionalRequestConflict"]:
+				# our listing is out of date for this object, so don't read it from the cache again
+				self.listed_etags.pop(key, None)
+				raise WriteConflictError(f"{key} was changed by another process.") from e
+			raise StorageError(f"Could not write {key} to munki repo at {self.url}.") from e
+		except botocore.exceptions.BotoCoreError as e:
+			raise StorageError(f"Could not write {key} to munki repo at {self.url}.") from e
+		self.etags[key] = response["ETag"]
+		self.write_cache(key, response["ETag"], data)
+
+	def lock_repo(self, exclusive):
+		# S3 has no locks, so runs put lock objects next to the pkgsinfo: one that marks exclusive access, and a shared marker
+		# per other run. Each run writes its own object before it looks for the others, so with S3's read-after-write
+		# consistency two runs never both go ahead
+		lock_key = self.prefix + LOCK_FILE
+		deadline = time.monotonic() + LOCK_TIMEOUT
+		waiting = False
+		while not self.try_lock_repo(lock_key, exclusive):
+			if time.monotonic() > deadline:
+				self.unlock_repo()
+				raise PromoterError(f"Timed out waiting for another munki-promoter run to release {lock_key} at {self.url}. If no other run is active, remove the lock object.")
+			if not waiting:
+				logging.info(f"Waiting for another munki-promoter run to release {lock_key} ...")
+				waiting = True
+			time.sleep(LOCK_RETRY_DELAY * LOCK_RETRIES)
+
+	def try_lock_repo(self, lock_key, exclusive):
+		try:
+			if exclusive:
+				if self.repo_lock_key != lock_key:
+					if not self.put_lock(lock_key):
+						if not self.remove_if_stale(lock_key) or not self.put_lock(lock_key):
+							return False
+				# wait for the runs that already hold a shared marker
+				markers = []
+				paginator = self.client.get_paginator("list_objects_v2")
+				for page in paginator.paginate(Bucket=self.bucket, Prefix=lock_key + ".shared."):
+					markers += [obj["Key"] for obj in page.get("Contents", [])]
+				active = [marker for marker in markers if not self.remove_if_stale(marker)]
+				return not active
+			self.put_lock(f"{lock_key}.shared.{uuid.uuid4().hex}")
+			if not self.remove_if_stale(lock_key):
+				# a run has exclusive access, try again once it is done
+				self.unlock_repo()
+				return False
+			return True
+		except (botocore.exceptions.BotoCoreError, botocore.exceptions.ClientError) as e:
+			raise PromoterError(f"Could not lock munki repo at {self.url}.") from e
+
+	def put_lock(self, key):
+		# returns whether the lock object was created, the owner and time in it tell others whose it is and how old it is
+		body = json.dumps({"owner": f"{socket.gethostname()}:{os.getpid()}", "created": datetime.datetime.now(datetime.timezone.utc).isoformat()})
+		try:
+			self.client.put_object(Bucket=self.bucket, Key=key, Body=body.encode(), IfNoneMatch="*")
+		except botocore.exceptions.ClientError as e:
+			if e.response["Error"]["Code"] in ["PreconditionFailed", "ConditionalRequestConflict"]:
+				return False
+			raise
+		self.repo_lock_key = key
+		return True
+
+	def read_lock(self, key):
+		# returns (owner, created, etag) of a lock object, or None if there is none
+		try:
+			response = self.client.get_object(Bucket=self.bucket, Key=key)
+			body = response["Body"].read()
+		except botocore.exceptions.ClientError as e:
+			if e.response["Error"]["Code"] in ["404", "NoSuchKey", "NotFound"]:
+				return None
+			raise
+		try:
+			lock = json.loads(body)
+			return lock["owner"], datetime.datetime.fromisoformat(lock["created"]), response["ETag"]
+		except (ValueError, TypeError, KeyError):
+			# written by an older version, which left the body empty
+			return "an unknown run", response["LastModified"], response["ETag"]
+
+	def remove_if_stale(self, key):
+		# removes a lock object of a run that did not clean up after itself, returns whether it is gone
+		lock = self.read_lock(key)
+		if not lock:
+			return True
+		owner, created, etag = lock
+		if datetime.datetime.now(datetime.timezone.utc) - created < datetime.timedelta(seconds=LOCK_STALE_AFTER):
+			return False
+		logging.warning(f"Removing lock {key} of {owner} from {created.isoformat()}, as it is older than {LOCK_STALE_AFTER // 60} minutes.")
+		try:
+			# only if it was not replaced in the meantime
+			self.client.delete_object(Bucket=self.bucket, Key=key, IfMatch=etag)
+		except botocore.exceptions.ClientError as e:
+			if e.response["Error"]["Code"] in ["PreconditionFailed", "ConditionalRequestConflict"]:
+				return False
+			if not e.response["Error"]["Code"] in ["404", "NoSuchKey", "NotFound"]:
+				raise
+		return True
+
+	def unlock_repo(self):
+		if self.repo_lock_key:
+			self.client.delete_object(Bucket=self.bucket, Key=self.repo_lock_key)
+			self.repo_lock_key = None
+
+	def close(self):
+		self.unlock_repo()
+		self.prune_cache()
+
+	def prune_cache(self):
+		# remove cached versions of objects that have since changed
+		if self.cache_dir and os.path.isdir(self.cache_dir):
+			current = {**self.listed_etags, **self.etags}
+			keep = {os.path.basename(self.get_cache_path(key, etag)) for key, etag in current.items()}
+			for file in os.listdir(self.cache_dir):
+				if self.is_cache_file(file) and not file in keep:
+					os.remove(os.path.join(self.cache_dir, file))
+
+def get_storage(munki_path, s3_endpoint_url=None, s3_cache=None):
+	if munki_path.startswith("s3://"):
+		return S3Storage(munki_path, endpoint_url=s3_endpoint_url, cache_dir=s3_cache)
+	return LocalStorage(munki_path)
+
+# ----------------------------------------
+#            Edit date store
+# ----------------------------------------
+class EditDateStore:
+	# keeps the last edit dates of items outside of the pkgsinfo files, can be used from several threads
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+		try:
+			self.connection = sqlite3.connect(path, check_same_thread=False)
+			self.connection.execute("CREATE TABLE IF NOT EXISTS edit_dates (path TEXT PRIMARY KEY, name TEXT NOT NULL, version TEXT NOT NULL, content_hash TEXT NOT NULL, edit_date TEXT NOT NULL)")
+			self.connection.execute("CREATE INDEX IF NOT EXISTS edit_dates_content_hash ON edit_dates (content_hash)")
+		except sqlite3.Error as e:
+			raise PromoterError(f"Could not open edit date store {path}.") from e
+
+	def get_edit_date(self, item_path, item):
+		name = item["name"]
+		version = str(item.get("version", ""))
+		with self.lock:
+			row = self.connection.execute("SELECT name, version, edit_date FROM edit_dates WHERE path = ?", (item_path,)).fetchone()
+			if row and row[:2] == (name, version):
+				return datetime.datetime.fromisoformat(row[2])
+			# the file may have been moved or renamed since the edit date was recorded
+			row = self.connection.execute("SELECT edit_date FROM edit_dates WHERE content_hash = ? AND name = ? AND version = ?", (get_content_hash(item), name, version)).fetchone()
+		if row:
+			return datetime.datetime.fromisoformat(row[0])
+		return None
+
+	def set_edit_date(self, item_path, item, edit_date):
+		with self.lock:
+			self.connection.execute("INSERT OR REPLACE INTO edit_dates VALUES (?, ?, ?, ?, ?)", (item_path, item["name"], str(item.get("version", "")), get_content_hash(item), edit_date.isoformat()))
+
+	def delete_edit_date(self, item_path):
+		with self.lock:
+			self.connection.execute("DELETE FROM edit_dates WHERE path = ?", (item_path,))
+
+	def commit(self):
+		with self.lock:
+			self.connection.commit()
+
+	def close(self):
+		with self.lock:
+			self.connection.commit()
+			self.connection.close()
+
+def get_content_hash(item):
+	# identifies an item regardless of its catalogs and metadata, which change when it is promoted
+	content = {key: value for key, value in item.items() if not key in ["catalogs", "_metadata"]}
+	return hashlib.sha256(plistlib.dumps(content)).hexdigest()
+
+def import_edit_dates(storage, state_store, pkgsinfo=None):
+	if pkgsinfo is None:
+		pkgsinfo = read_pkgsinfo(storage)
+	count = 0
+	for file, pkginfo in pkgsinfo:
+		if "name" in pkginfo and "_metadata" in pkginfo and "munki-promoter_edit_date" in pkginfo["_metadata"]:
+			state_store.set_edit_date(file, pkginfo, pkginfo["_metadata"]["munki-promoter_edit_date"])
+			count += 1
+	state_store.commit()
+	return count
+
+def prep_export_edit_dates(storage, state_store, pkgsinfo=None, evaluators=None):
+	if pkgsinfo is None:
+		pkgsinfo = read_pkgsinfo(storage)
+	names = []
+	changes = []
+	for file, pkginfo in pkgsinfo:
+		item = prep_item_export_edit_date(pkginfo, file, state_store)
+		if item:
+			names.append(item["name"])
+			changes.append((file, item))
+			if evaluators is not None:
+				evaluators[file] = functools.partial(prep_item_export_edit_date, item_path=file, state_store=state_store)
+	return names, changes
+
+def prep_item_export_edit_date(item, item_path, state_store):
+	if not "name" in item:
+		raise PromoterError(f"File {item_path} is missing expected keys.")
+	edit_date = state_store.get_edit_date(item_path, item)
+	if not edit_date:
+		return None
+	if not "_metadata" in item:
+		item["_metadata"] = dict()
+	if item["_metadata"].get("munki-promoter_edit_date") == edit_date:
+		return None
+	item["_metadata"]["munki-promoter_edit_date"] = edit_date
+	return item
+
+# ----------------------------------------
+#         Installer verification
+# ----------------------------------------
+class InstallerHashCache:
+	# keeps the sha256 of installer items, so they are only hashed again when their size or mtime changes
+	def __init__(self, path):
+		self.path = path
+		try:
+			if os.path.dirname(path):
+				os.makedirs(os.path.dirname(path), exist_ok=True)
+			self.connection = sqlite3.connect(path)
+			self.connection.execute("CREATE TABLE IF NOT EXISTS installer_hashes (path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL)")
+		except (OSError, sqlite3.Error) as e:
+			raise PromoterError(f"Could not open installer hash cache {path}.") from e
+
+	def get_hash(self, path, size, mtime_ns):
+		row = self.connection.execute("SELECT hash FROM installer_hashes WHERE path = ? AND size = ? AND mtime_ns = ?", (path, size, mtime_ns)).fetchone()
+		return row[0] if row else None
+
+	def set_hash(self, path, size, mtime_ns, digest):
+		self.connection.execute("INSERT OR REPLACE INTO installer_hashes VALUES (?, ?, ?, ?)", (path, size, mtime_ns, digest))
+
+	def commit(self):
+		self.connection.commit()
+
+	def close(self):
+		self.connection.commit()
+		self.connection.close()
+
+def get_pkgs_path(munki_path):
+	# pkgs is next to pkgsinfo in a munki repo
+	return os.path.join(os.path.dirname(os.path.normpath(munki_path)), "pkgs")
+
+def hash_file(path):
+	digest = hashlib.sha256()
+	with open(path, "rb") as fp:
+		try:
+			with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+				digest.update(mapped)
+		except (ValueError, OSError):
+			# empty files and some file systems can't be memory-mapped
+			for chunk in iter(functools.partial(fp.read, HASH_BUFFER_SIZE), b""):
+				digest.update(chunk)
+	return digest.hexdigest()
+
+def verify_installers(items, pkgs_path, hash_cache=None, max_workers=HASH_WORKERS, summary=None):
+	# returns {item_path: reason} of every item whose installer is missing or does not match its installer_item_hash
+	failures = dict()
+	checks = []
+	stats = dict()
+	for item_path, item in items:
+		if not "installer_item_location" in item:
+			# nopkg items have no installer
+			continue
+		installer_path = os.path.abspath(os.path.join(pkgs_path, item["installer_item_location"]))
+		try:
+			stat = os.stat(installer_path)
+		except OSError:
+			failures[item_path] = f"installer {item['installer_item_location']} is missing"
+			continue
+		if not "installer_item_hash" in item:
+			failures[item_path] = "installer_item_hash is missing"
+			continue
+		checks.append((item_path, installer_path, item["installer_item_hash"]))
+		stats[installer_path] = (stat.st_size, stat.st_mtime_ns)
+	digests = dict()
+	if hash_cache:
+		for installer_path, (size, mtime_ns) in stats.items():
+			digest = hash_cache.get_hash(installer_path, size, mtime_ns)
+			if digest:
+				digests[installer_path] = digest
+	pending = [installer_path for installer_path in stats if not installer_path in digests]
+	if pending:
+		logging.info(f"Hashing {len(pending)} installers ...")
+		# hashlib releases the GIL while hashing, so threads hash in parallel
+		with concurrent.futures.ThreadPoolExecutor(max_workers) as pool:
+			futures = {installer_path: pool.submit(hash_file, installer_path) for installer_path in pending}
+			for installer_path, future in futures.items():
+				try:
+					digests[installer_path] = future.result()
+				except OSError as e:
+					logging.warning(f"Could not read installer {installer_path}: {e}")
+					continue
+				if hash_cache:
+					hash_cache.set_hash(installer_path, *stats[installer_path], digests[installer_path])
+		if hash_cache:
+			hash_cache.commit()
+	for item_path, installer_path, expected in checks:
+		if not installer_path in digests:
+			failures[item_path] = f"installer {os.path.relpath(installer_path, pkgs_path)} could not be read"
+		elif digests[installer_path] != expected:
+			failures[item_path] = f"installer {os.path.relpath(installer_path, pkgs_path)} does not match installer_item_hash"
+	for item_path, reason in failures.items():
+		logging.debug(f"File {item_path} will not be promoted: {reason}.")
+		add_to_summary(summary, "excluded", item_path)
+	return failures
+
+# ----------------------------------------
+#              Dependencies
+# ----------------------------------------
+class DependencyGraph:
+	# index of all items by name and name-version, to resolve their requires and update_for references
+	def __init__(self, pkgsinfo):
+		self.items = dict()
+		self.by_name = dict()
+		self.by_name_version = dict()
+		for path, pkginfo in pkgsinfo:
+			if not "name" in pkginfo:
+				continue
+			self.items[path] = pkginfo
+			self.by_name.setdefault(pkginfo["name"], []).append(path)
+			self.by_name_version.setdefault(f"{pkginfo['name']}-{pkginfo.get('version', '')}", []).append(path)
+
+	def lookup(self, ref):
+		# munki accepts name, name-version and name--version
+		return self.by_name_version.get(ref.replace("--", "-", 1), []) + self.by_name.get(ref, [])
+
+	def get_dependencies(self, pkginfo):
+		dependencies = []
+		for key, description in [("requires", "requires"), ("update_for", "is an update for")]:
+			refs = pkginfo.get(key, [])
+			if isinstance(refs, str):
+				refs = [refs]
+			dependencies += [(description, ref) for ref in refs]
+		return dependencies
+
+def get_downstream_catalogs(config, config_path):
+	# catalog -> the catalog itself and every catalog its items can be promoted to later on, by a promotion or by the
+	# rules of one of its custom items
+	edges = dict()
+	promotions = config["promotions"]
+	for promotion in promotions:
+		promote_to, promote_from, days, custom_items = get_promotion_info(promotion, promotions, config, config_path)
+		rules = [(promote_to, promote_from)]
+		for name in custom_items:
+			item_promote_to, item_promote_from, _, _ = get_item_promotion_rules(name, promote_to, promote_from, days, custom_items)
+			rules.append((item_promote_to, item_promote_from))
+		for rule_promote_to, rule_promote_from in rules:
+			for catalog in rule_promote_from:
+				edges.setdefault(catalog, set()).update(rule_promote_to)
+	downstream = dict()
+	for catalog in edges:
+		reachable = {catalog}
+		pending = [catalog]
+		while pending:
+			for next_catalog in edges.get(pending.pop(), []):
+				if not next_catalog in reachable:
+					reachable.add(next_catalog)
+					pending.append(next_catalog)
+		downstream[catalog] = reachable
+	return downstream
+
+def version_key(version):
+	return [int(part) for part in re.findall(r"\d+", str(version))]
+
+def resolve_dependencies(records, graph, config, config_path, verify=None, pull=False, state_store=None, summary=None):
+	# returns (records, excluded), where excluded are (record, reason) of items held back because verify failed them or
+	# a dependency will not be available in their new catalogs. Dependencies that are available in a catalog that comes
+	# later in the promotions also count, as clients in earlier catalogs usually include those.
+	downstream = get_downstream_catalogs(config, config_path)
+	planned = {record[3][2][0]: record for record in records}
+	held = dict()
+
+	def get_catalogs_after(path):
+		if path in planned and not path in held:
+			return planned[path][3][2][1]["catalogs"]
+		return graph.items[path].get("catalogs", [])
+
+	def is_available(candidates, path, catalogs):
+		available = set()
+		for candidate in candidates:
+			if candidate != path:
+				available.update(get_catalogs_after(candidate))
+		return all(available & downstream.get(catalog, {catalog}) for catalog in catalogs)
+
+	if pull:
+		# add the dependencies that are in the same catalogs as the item that requires them, so they can move along with it
+		queue = list(records)
+		for promotion, promote_to, pkginfo, item_promo_info in queue:
+			path = item_promo_info[2][0]
+			for _, ref in graph.get_dependencies(pkginfo):
+				candidates = graph.lookup(ref)
+				if is_available(candidates, path, pkginfo["catalogs"]):
+					continue
+				same_stage = [candidate for candidate in candidates if not candidate in planned and set(graph.items[candidate].get("catalogs", [])) == set(graph.items[path].get("catalogs", []))]
+				# dependencies the selections leave out are never pulled, the item that requires them is held back instead
+				selected = [candidate for candidate in same_stage if check_selections(config, graph.items[candidate])]
+				if len(selected) < len(same_stage):
+					logging.debug(f"File {path} depends on {ref}, which is left out by the selections and will not be pulled along.")
+				if not selected:
+					continue
+				dependency_path = max(selected, key=lambda candidate: version_key(graph.items[candidate].get("version", "")))
+				dependency = copy.deepcopy(graph.items[dependency_path])
+				dependency["catalogs"] = pkginfo["catalogs"]
+				if not "_metadata" in dependency:
+					dependency["_metadata"] = dict()
+				if not state_store:
+					dependency["_metadata"]["munki-promoter_edit_date"] = datetime.datetime.now()
+				custom_promote_to = pkginfo["catalogs"] if pkginfo["catalogs"] != promote_to else None
+				record = (promotion, promote_to, dependency, (dependency["name"], dependency.get("version", ""), (dependency_path, dependency), custom_promote_to))
+				planned[dependency_path] = record
+				queue.append(record)
+				logging.debug(f"File {dependency_path} is pulled along with {path}, which depends on {ref}.")
+				add_to_summary(summary, "pulled", dependency_path)
+
+	failures = dict()
+	if verify:
+		failures = verify([record[3][2] for record in planned.values()])
+
+	# an item is decided once all planned items it depends on are decided, so one pass in topological order
+	dependencies = {path: set() for path in planned}
+	dependents = {path: [] for path in planned}
+	for path, record in planned.items():
+		for _, ref in graph.get_dependencies(record[2]):
+			for candidate in graph.lookup(ref):
+				if candidate in planned and candidate != path and not candidate in dependencies[path]:
+					dependencies[path].add(candidate)
+					dependents[candidate].append(path)
+	in_degree = {path: len(dependencies[path]) for path in planned}
+	queue = [path for path in planned if in_degree[path] == 0]
+	order = []
+	while queue:
+		path = queue.pop()
+		order.append(path)
+		for dependent in dependents[path]:
+			in_degree[dependent] -= 1
+			if in_degree[dependent] == 0:
+				queue.append(dependent)
+	# items that depend on each other are decided last, in file order
+	order += [path for path in planned if in_degree[path] > 0]
+	for path in order:
+		pkginfo = planned[path][2]
+		if path in failures:
+			held[path] = failures[path]
+			continue
+		for description, ref in graph.get_dependencies(pkginfo):
+			if not is_available(graph.lookup(ref), path, pkginfo["catalogs"]):
+				held[path] = f"{description} {ref}, which will not be in the {and_str(pkginfo['catalogs'])} catalog(s)"
+				logging.debug(f"File {path} will not be promoted: {held[path]}.")
+				add_to_summary(summary, "held", path)
+				break
+	kept = [record for path, record in planned.items() if not path in held]
+	excluded = [(record, held[path]) for path, record in planned.items() if path in held]
+	return kept, excluded
+
+# ----------------------------------------
+#                Journal
+# ----------------------------------------
+class Journal:
+	# write-ahead log of a promotion run, one json object per line: the planned writes first, then the status of every
+	# write once it is applied, so an interrupted run can be resumed or rolled back without scanning the repo
+	def __init__(self, path):
+		self.path = path
+		self.fp = None
+		self.today = datetime.datetime.now()
+
+	def start(self, writes, state_store=None, missing_edit_dates=()):
+		# writes are (item_path, original pkginfo, pkginfo to write), missing_edit_dates are the same for items that only get
+		# the edit date the prep set for them. The originals are as read from the repo, before anything was written
+		if os.path.exists(self.path):
+			_, entries, statuses = read_journal(self.path)
+			if any(not entry["path"] in statuses for entry in entries):
+				raise PromoterError(f"Journal {self.path} belongs to a run that did not finish. Resume or roll it back first.")
+		lines = [{"type": "run", "started": self.today.isoformat(), "state_db": bool(state_store)}]
+		for item_path, original, item in writes:
+			lines.append(self.entry(item_path, original, item, state_store, self.today if state_store else item["_metadata"]["munki-promoter_edit_date"]))
+		for item_path, original, item in missing_edit_dates:
+			# rolling these back removes the edit date again
+			lines.append(self.entry(item_path, original, item, state_store, item["_metadata"]["munki-promoter_edit_date"]))
+		try:
+			self.fp = open(self.path, "w")
+			self.write(lines)
+			# make sure the journal itself can be found after a crash
+			directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+			try:
+				os.fsync(directory)
+			finally:
+				os.close(directory)
+		except OSError as e:
+			raise PromoterError(f"Could not write journal {self.path}.") from e
+
+	def entry(self, item_path, original, item, state_store, after_edit_date):
+		before_edit_date = get_edit_date(original, item_path, state_store)
+		return {
+			"type": "write",
+			"path": item_path,
+			"name": item["name"],
+			"version": item.get("version", ""),
+			"before": {"catalogs": original["catalogs"], "edit_date": before_edit_date.isoformat() if before_edit_date else None},
+			"after": {"catalogs": item["catalogs"], "edit_date": after_edit_date.isoformat()},
+		}
+
+	def open(self):
+		try:
+			self.fp = open(self.path, "a")
+		except OSError as e:
+			raise PromoterError(f"Could not open journal {self.path}.") from e
+
+	def write(self, lines):
+		for line in lines:
+			self.fp.write(json.dumps(line) + "\n")
+		self.fp.flush()
+		os.fsync(self.fp.fileno())
+
+	def mark(self, item_path, status):
+		try:
+			self.write([{"type": status, "path": item_path}])
+		except OSError as e:
+			raise PromoterError(f"Could not write to journal {self.path}.") from e
+
+	def close(self):
+		if self.fp:
+			self.fp.close()
+			self.fp = None
+
+def read_journal(path):
+	# returns the run header, the planned writes and {item_path: status} of the writes that have a status
+	header = None
+	entries = []
+	statuses = dict()
+	try:
+		with open(path) as fp:
+			for line in fp:
+				try:
+					entry = json.loads(line)
+				except ValueError:
+					# a line that was cut off by the interruption
+					continue
+				if not isinstance(entry, dict):
+					continue
+				if entry.get("type") == "run":
+					header = entry
+				elif entry.get("type") == "write":
+					entries.append(entry)
+				elif "path" in entry:
+					statuses[entry["path"]] = entry.get("type")
+	except OSError as e:
+		raise PromoterError(f"Could not read journal {path}.") from e
+	if not header:
+		raise PromoterError(f"{path} is not a munki-promoter journal.")
+	return header, entries, statuses
+
+def set_journal_state(storage, state_store, entry, state):
+	# sets the catalogs and edit date of an item to the before or after state of a journal entry, returns the written item
+	item_path = entry["path"]
+	item = plistlib.loads(storage.read_item(item_path))
+	item["catalogs"] = entry[state]["catalogs"]
+	edit_date = entry[state]["edit_date"]
+	if not state_store:
+		if not "_metadata" in item:
+			item["_metadata"] = dict()
+		if edit_date:
+			item["_metadata"]["munki-promoter_edit_date"] = datetime.datetime.fromisoformat(edit_date)
+		else:
+			item["_metadata"].pop("munki-promoter_edit_date", None)
+	# nothing to re-evaluate, if another process changes the item in the meantime we leave it alone
+	item = write_item(storage, item_path, item)
+	if item and state_store:
+		if edit_date:
+			state_store.set_edit_date(item_path, item, datetime.datetime.fromisoformat(edit_date))
+		else:
+			state_store.delete_edit_date(item_path)
+	return item
+
+def replay_journal(storage, path, state_store=None, rollback=False):
+	# finishes the writes of a journal that were not applied, or reverts the ones that were. Returns (applied, skipped) paths
+	header, entries, statuses = read_journal(path)
+	if header["state_db"] and not state_store:
+		raise PromoterError(f"The run in journal {path} kept edit dates in a state database, which is needed to {'roll it back' if rollback else 'resume it'}.")
+	journal = Journal(path)
+	journal.open()
+	applied = []
+	skipped = []
+	try:
+		for entry in entries:
+			item_path = entry["path"]
+			status = statuses.get(item_path)
+			if status == "skipped" or status == "rolled_back" or (status == "done" and not rollback):
+				continue
+			try:
+				current = plistlib.loads(storage.read_item(item_path))
+			except (PromoterError, plistlib.InvalidFileException):
+				logging.warning(f"File {item_path} from journal {path} could not be read and will be skipped.")
+				skipped.append(item_path)
+				continue
+			before = set(entry["before"]["catalogs"])
+			after = set(entry["after"]["catalogs"])
+			if rollback:
+				# writes without a status may have been applied just before the run was interrupted
+				if set(current.get("catalogs", [])) != after:
+					if status == "done":
+						logging.warning(f"File {item_path} was changed since it was promoted and will not be rolled back.")
+						skipped.append(item_path)
+					continue
+				if not set_journal_state(storage, state_store, entry, "before"):
+					skipped.append(item_path)
+					continue
+				journal.mark(item_path, "rolled_back")
+			else:
+				if set(current.get("catalogs", [])) == after and before != after:
+					# written just before the run was interrupted
+					journal.mark(item_path, "done")
+					continue
+				if set(current.get("catalogs", [])) != before:
+					logging.warning(f"File {item_path} was changed since the journal was written and will be skipped.")
+					journal.mark(item_path, "skipped")
+					skipped.append(item_path)
+					continue
+				if not set_journal_state(storage, state_store, entry, "after"):
+					journal.mark(item_path, "skipped")
+					skipped.append(item_path)
+					continue
+				journal.mark(item_path, "done")
+			applied.append(item_path)
+	except StorageError as e:
+		raise PromoterError(f"Could not write to file {item_path} in munki directory.") from e
+	finally:
+		journal.close()
+		if state_store:
+			state_store.commit()
+	return applied, skipped
+
+# ----------------------------------------
+#                Pipeline
+# ----------------------------------------
+def promote_all_pipelined(config, storage, config_path, state_store=None, summary=None, evaluators=None, queue_size=PIPELINE_QUEUE_SIZE, readers=PIPELINE_READERS):
+	# runs all promotions as scan -> parse -> evaluate -> write stages connected by bounded queues, so items are written
+	# as soon as they are found eligible while others are still being read. Returns (records that were written, skipped)
+	# in file order, like prep_all_promotions followed by promote_items
+	if not (config and "promotions" in config and type(config["promotions"]) == dict):
+		# error: bad yaml config
+		raise PromoterError(f'No promotions are currently defined in {config_path}.')
+	for promotion in config["promotions"]:
+		# check the promotions before anything is written
+		get_promotion_info(promotion, config["promotions"], config, config_path)
+	paths = queue.Queue(queue_size)
+	parsed = queue.Queue(queue_size)
+	writes = queue.Queue(queue_size)
+	# the first error stops all stages, which keep draining their queue so no stage blocks on a full queue. stop does the
+	# same when the evaluation stops early
+	errors = []
+	stop = threading.Event()
+	results = []
+	today = datetime.datetime.now()
+
+	def scan():
+		try:
+			for index, (path, _, _) in enumerate(storage.list_items()):
+				if errors or stop.is_set():
+					break
+				paths.put((index, path))
+		except Exception as e:
+			errors.append(e)
+		finally:
+			for _ in range(readers):
+				paths.put(None)
+
+	def parse():
+		try:
+			while True:
+				entry = paths.get()
+				if entry is None:
+					return
+				if errors or stop.is_set():
+					continue
+				index, path = entry
+				try:
+					data = storage.read_item(path)
+					try:
+						pkginfo = plistlib.loads(data)
+					except plistlib.InvalidFileException as e:
+						raise PromoterError(f"Could not load file {path} in munki directory.") from e
+					parsed.put((index, path, pkginfo))
+				except Exception as e:
+					errors.append(e)
+		finally:
+			parsed.put(None)
+
+	def write():
+		while True:
+			entry = writes.get()
+			if entry is None:
+				return
+			if errors or stop.is_set():
+				continue
+			index, record, missing_edit_dates = entry
+			try:
+				# the state store is committed once when the pipeline is done
+				for item_path, item in missing_edit_dates.items():
+					apply_edit_date(storage, state_store, item_path, item, summary)
+			except Exception as e:
+				errors.append(e)
+				continue
+			if not record:
+				continue
+			item_path, item = record[3][2]
+			try:
+				logging.debug(f"Promoting {item_path} to {item['catalogs']}")
+				written = write_record(storage, record, summary, evaluators)
+				if written:
+					add_to_summary(summary, "promoted", item_path)
+					if state_store:
+						state_store.set_edit_date(item_path, written[3][2][1], today)
+				results.append((index, written or record, bool(written)))
+			except StorageError as e:
+				error = PromoterError(f"Could not write to file {item_path} in munki directory.")
+				error.__cause__ = e
+				errors.append(error)
+			except Exception as e:
+				errors.append(e)
+
+	threads = [threading.Thread(target=scan, daemon=True), threading.Thread(target=write, daemon=True)]
+	threads += [threading.Thread(target=parse, daemon=True) for _ in range(readers)]
+	for thread in threads:
+		thread.start()
+	# evaluate in this thread, the other stages are mostly waiting on I/O
+	finished_readers = 0
+	try:
+		while finished_readers < readers:
+			entry = parsed.get()
+			if entry is None:
+				finished_readers += 1
+				continue
+			if errors:
+				continue
+			index, path, pkginfo = entry
+			missing_edit_dates = dict()
+			try:
+				record = prep_pkginfo_all_promotions(pkginfo, path, config, config_path, state_store, summary, evaluators, missing_edit_dates)
+			except Exception as e:
+				errors.append(e)
+				continue
+			if record or missing_edit_dates:
+				writes.put((index, record, missing_edit_dates))
+	finally:
+		if finished_readers < readers:
+			stop.set()
+			# the readers may be blocked on the full parsed queue, so take from it until they have all finished
+			while finished_readers < readers:
+				if parsed.get() is None:
+					finished_readers += 1
+		writes.put(None)
+		for thread in threads:
+			thread.join()
+	if state_store:
+		state_store.commit()
+	if errors:
+		raise errors[0]
+	results.sort(key=lambda result: result[0])
+	records = [record for _, record, written in results if written]
+	skipped = [record[3][2][0] for _, record, written in results if not written]
+	return records, skipped
+
+# ----------------------------------------
+#                  Git
+# ----------------------------------------
+def run_git(args, cwd, input=None, env=None):
+	try:
+		process = subprocess.run(["git"] + args, cwd=cwd, input=input, env=env, capture_output=True, text=True)
+	except OSError as e:
+		raise PromoterError("git could not be run. Make sure it is installed to use `git-commit`.") from e
+	return process.returncode, process.stdout.strip(), process.stderr.strip()
+
+def check_git(args, cwd, input=None, env=None):
+	returncode, stdout, stderr = run_git(args, cwd, input, env)
+	if returncode != 0:
+		raise PromoterError(f"git {args[0]} failed in {cwd}: {stderr}")
+	return stdout
+
+def check_git_repo(cwd, branch=None):
+	# checks that commits can be made for files in cwd, on a new branch if given, and returns the top level of the worktree
+	returncode, toplevel, _ = run_git(["rev-parse", "--show-toplevel"], cwd)
+	if returncode != 0 or not toplevel:
+		raise PromoterError(f"The munki repo {cwd} is not in a git worktree, which `git-commit` needs.")
+	if branch:
+		ref = f"refs/heads/{branch}"
+		if run_git(["check-ref-format", ref], toplevel)[0] != 0:
+			raise PromoterError(f'"{branch}" is not a valid git branch name.')
+		if run_git(["rev-parse", "--verify", "-q", ref], toplevel)[0] == 0:
+			raise PromoterError(f'Git branch "{branch}" already exists.')
+	return toplevel
+
+def git_commit_paths(paths, message, cwd, branch=None):
+	# commits exactly the given files on top of HEAD without looking at the rest of the worktree, returns the commit
+	toplevel = check_git_repo(cwd, branch)
+	paths = [os.path.realpath(path) for path in paths]
+	relpaths = [os.path.relpath(path, toplevel) for path in paths]
+	if any(relpath.startswith("..") for relpath in relpaths):
+		raise PromoterError(f"The munki repo {cwd} is not inside the git repository {toplevel}.")
+	blobs = check_git(["hash-object", "-w", "--stdin-paths"], toplevel, input="\n".join(paths) + "\n").splitlines()
+	index_info = "".join(f"{'100755' if os.stat(path).st_mode & 0o111 else '100644'} {blob}\t{relpath}\n" for path, blob, relpath in zip(paths, blobs, relpaths))
+	returncode, parent, _ = run_git(["rev-parse", "--verify", "-q", "HEAD"], toplevel)
+	parent = parent if returncode == 0 else None
+	if branch:
+		ref = f"refs/heads/{branch}"
+	else:
+		returncode, ref, _ = run_git(["symbolic-ref", "-q", "HEAD"], toplevel)
+		if returncode != 0:
+			# detached HEAD
+			ref = "HEAD"
+	env = dict(os.environ)
+	if not run_git(["config", "user.name"], toplevel)[1]:
+		env.update({"GIT_AUTHOR_NAME": "munki-promoter", "GIT_COMMITTER_NAME": "munki-promoter"})
+	if not run_git(["config", "user.email"], toplevel)[1]:
+		env.update({"GIT_AUTHOR_EMAIL": "munki-promoter@localhost", "GIT_COMMITTER_EMAIL": "munki-promoter@localhost"})
+	with tempfile.TemporaryDirectory() as directory:
+		# build the tree in a separate index, so whatever else is staged is left out of the commit
+		env["GIT_INDEX_FILE"] = os.path.join(directory, "index")
+		check_git(["read-tree", parent] if parent else ["read-tree", "--empty"], toplevel, env=env)
+		check_git(["update-index", "--add", "--index-info"], toplevel, input=index_info, env=env)
+		tree = check_git(["write-tree"], toplevel, env=env)
+		del env["GIT_INDEX_FILE"]
+	commit = check_git(["commit-tree", tree] + (["-p", parent] if parent else []) + ["-F", "-"], toplevel, input=message, env=env)
+	# only move the ref if nobody else did in the meantime
+	check_git(["update-ref", "-m", f"munki-promoter: {message.splitlines()[0]}", ref, commit, parent if parent and not branch else "0" * len(commit)], toplevel)
+	if not branch:
+		# the files are committed as they are in the worktree, so show them as unchanged in the index too
+		check_git(["update-index", "--add", "--index-info"], toplevel, input=index_info)
+	return commit
+
+# ----------------------------------------
+#                Engine
+# ----------------------------------------
+class Promoter:
+	# keeps the config and the parsed pkgsinfo in memory, so repeated calls only re-read files that changed
+	def __init__(self, munki_path=MUNKI_PATH, config_path=CONFIG_FILE, is_config_specified=False, config=None, storage=None, state_store=None, vectorised=False, verify_installers=False, pkgs_path=None, hash_cache=None, dependencies="ignore"):
+		if config is None:
+			config = get_config(config_path, is_config_specified)
+		check_config(config, config_path)
+		self.config = config
+		self.config_path = config_path
+		self.storage = storage if storage else get_storage(munki_path)
+		self.state_store = state_store
+		self.vectorised = vectorised
+		self.verify_installers = verify_installers
+		if verify_installers and not pkgs_path:
+			if not isinstance(self.storage, LocalStorage):
+				raise PromoterError("Verifying installers of a munki repo that is not stored locally requires the path to a local copy of its pkgs directory.")
+			pkgs_path = get_pkgs_path(self.storage.root)
+		self.pkgs_path = pkgs_path
+		self.hash_cache = hash_cache
+		if not dependencies in ["ignore", "hold", "pull"]:
+			raise PromoterError(f'Unknown way to handle dependencies "{dependencies}", use ignore, hold or pull.')
+		self.dependencies = dependencies
+		# path -> ((size, etag), pkginfo) of every item as it was when last read
+		self.index = dict()
+		# built from the index when dependencies are first needed after it changed
+		self.graph = None
+		# paths of items per event in the last run, logged as one summary line per event instead of one line per item
+		self.summary = dict()
+		# functions to re-evaluate an item of the last prep with, if it changed after it was read
+		self.evaluators = dict()
+
+	def lock(self, exclusive=False):
+		self.storage.lock_repo(exclusive)
+
+	def refresh(self):
+		# re-reads new and changed files and forgets removed ones, returns the paths that were read
+		listed = {path: (size, etag) for path, size, etag in self.storage.list_items()}
+		changed = [path for path in listed if not (path in self.index and self.index[path][0] == listed[path])]
+		parsed = dict(read_pkgsinfo(self.storage, changed))
+		if changed or len(listed) != len(self.index):
+			self.graph = None
+		self.index = {path: (listed[path], parsed[path]) if path in parsed else self.index[path] for path in listed}
+		return changed
+
+	def get_graph(self):
+		if not self.graph:
+			self.graph = DependencyGraph((path, pkginfo) for path, (_, pkginfo) in self.index.items())
+		return self.graph
+
+	def start_run(self):
+		# every prep starts a new run, so the summary only covers that prep and applying its result
+		self.summary = dict()
+		self.evaluators = dict()
+
+	def pkgsinfo(self):
+		# the prep functions change the items they are given, so hand out copies
+		self.refresh()
+		return [(path, copy.deepcopy(pkginfo)) for path, (_, pkginfo) in self.index.items()]
+
+	def prep_promotion(self, promotion):
+		# like all prep methods this only reads, the result is applied with promote()
+		self.start_run()
+		missing_edit_dates = dict()
+		records = prep_single_promotion(promotion, self.config, self.storage, self.config_path, self.state_store, self.pkgsinfo(), self.summary, self.evaluators, missing_edit_dates)
+		return self.describe(records, [promotion], missing_edit_dates)
+
+	def prep_all_promotions(self):
+		self.start_run()
+		missing_edit_dates = dict()
+		if self.vectorised:
+			records = prep_all_promotions_vectorised(self.config, self.storage, self.config_path, self.state_store, self.pkgsinfo(), self.summary, self.evaluators, missing_edit_dates)
+		else:
+			records = prep_all_promotions(self.config, self.storage, self.config_path, self.state_store, self.pkgsinfo(), self.summary, self.evaluators, missing_edit_dates)
+		return self.describe(records, self.config["promotions"], missing_edit_dates)
+
+	def describe(self, records, promotions, missing_edit_dates=None):
+		verify = None
+		if self.verify_installers:
+			verify = functools.partial(verify_installers, pkgs_path=self.pkgs_path, hash_cache=self.hash_cache, summary=self.summary)
+		if self.dependencies == "ignore":
+			failures = verify([item_promo_info[2] for _, _, _, item_promo_info in records]) if verify else dict()
+			excluded = [(record, failures[record[3][2][0]]) for record in records if record[3][2][0] in failures]
+			records = [record for record in records if not record[3][2][0] in failures]
+		else:
+			# pulled dependencies are verified too, and items that depend on items that fail are held back
+			records, excluded = resolve_dependencies(records, self.get_graph(), self.config, self.config_path, verify=verify, pull=self.dependencies == "pull", state_store=self.state_store, summary=self.summary)
+		return describe_records(records, promotions, excluded, missing_edit_dates)
+
+	def promote(self, result, journal_path=None):
+		# writes the missing edit dates and promotions of a prep result. Returns the result of what was actually
+		# promoted, like prep_all_promotions, and the paths that were skipped because another process changed or locked them
+		journal = None
+		if journal_path:
+			journal = Journal(journal_path)
+			journal.start([(item_path, self.index[item_path][1], item) for item_path, item in result["items"]], self.state_store,
+				[(item_path, self.index[item_path][1], item) for item_path, item in result["missing_edit_dates"]])
+		try:
+			record_missing_edit_dates(self.storage, result["missing_edit_dates"], self.state_store, self.summary, journal)
+			promoted, skipped = promote_items(self.storage, result["records"], self.state_store, journal, self.summary, self.evaluators)
+			return describe_records(promoted, self.config["promotions"], result["excluded"]), skipped
+		finally:
+			if journal:
+				journal.close()
+
+	def record_missing_edit_dates(self, result):
+		# writes the edit dates that a prep set for items without one, for results that are not promoted
+		record_missing_edit_dates(self.storage, result["missing_edit_dates"], self.state_store, self.summary)
+
+	def check_commit(self, branch=None):
+		# call before writing anything, so a run that can not commit its changes does not make them
+		if not isinstance(self.storage, LocalStorage):
+			raise PromoterError("Committing changes with git requires a munki repo that is stored locally.")
+		check_git_repo(self.storage.root, branch)
+
+	def commit(self, message, branch=None):
+		# commits the files written since the last commit to the git repository the munki repo is in, returns the commit
+		if not isinstance(self.storage, LocalStorage):
+			raise PromoterError("Committing changes with git requires a munki repo that is stored locally.")
+		if not self.storage.written:
+			return None
+		commit = git_commit_paths(list(self.storage.written), message, self.storage.root, branch)
+		self.storage.written.clear()
+		return commit
+
+	def promote_pipelined(self):
+		# evaluates and promotes all promotions in one go, returns the result like prep_all_promotions and the skipped paths
+		self.start_run()
+		records, skipped = promote_all_pipelined(self.config, self.storage, self.config_path, self.state_store, self.summary, self.evaluators)
+		return describe_records(records, self.config["promotions"]), skipped
+
+	def resume(self, journal_path):
+		# returns (applied, skipped) paths
+		self.start_run()
+		return replay_journal(self.storage, journal_path, self.state_store)
+
+	def rollback(self, journal_path):
+		# returns (rolled back, skipped) paths
+		self.start_run()
+		return replay_journal(self.storage, journal_path, self.state_store, rollback=True)
+
+	def prep_edit_dates(self, overwrite=False, promotion=None, promote_from_days=None):
+		if promote_from_days and not promotion:
+			raise PromoterError("Argument `days-before-promote-from` must be accompanied by argument `promotion`. For all items that meet the `promote_from` conditions for the given promotion, if the last edit date is unknown but the creation date is known, the last edit date is calculated under the assumption that it took n days to be promoted to the current catalogue(s), where n is set by this `days-before-promote-from` argument.")
+		self.start_run()
+		return prep_set_edit_date(self.storage, self.config, overwrite=overwrite, promotion=promotion, promote_from_days=promote_from_days, config_path=self.config_path, state_store=self.state_store, pkgsinfo=self.pkgsinfo(), summary=self.summary, evaluators=self.evaluators)
+
+	def prep_export_edit_dates(self):
+		self.check_state_store()
+		self.start_run()
+		return prep_export_edit_dates(self.storage, self.state_store, self.pkgsinfo(), self.evaluators)
+
+	def apply_edit_dates(self, changes, export=False):
+		# returns the paths that were skipped because another process changed or locked them
+		skipped = []
+		for item_path, item in changes:
+			if export:
+				is_applied = try_add_metadata(self.storage, item_path, item, self.summary, self.evaluators)
+			else:
+				is_applied = apply_edit_date(self.storage, self.state_store, item_path, item, self.summary, self.evaluators)
+			if not is_applied:
+				skipped.append(item_path)
+		if self.state_store:
+			self.state_store.commit()
+		return skipped
+
+	def import_edit_dates(self):
+		self.check_state_store()
+		return import_edit_dates(self.storage, self.state_store, self.pkgsinfo())
+
+	def check_state_store(self):
+		if not self.state_store:
+			raise PromoterError("Importing and exporting edit dates requires a state database, but none is set.")
+
+	def simulate(self, days_to_simulate, promotion=None):
+		self.start_run()
+		return simulate_promotions(self.config, self.storage, self.config_path, days_to_simulate, promotion=promotion, state_store=self.state_store, pkgsinfo=self.pkgsinfo(), summary=self.summary)
+
+	def close(self):
+		self.storage.close()
+		if self.state_store:
+			self.state_store.close()
+		if self.hash_cache:
+			self.hash_cache.close()
+
+# ----------------------------------------
+#               Logging
+# ----------------------------------------
+class LogQueueHandler(logging.handlers.QueueHandler):
+	def prepare(self, record):
+		# the listener runs in this process, so leave formatting to its thread and only merge the message arguments
+		record.msg = record.getMessage()
+		record.args = None
+		return record
+
+class JsonFormatter(logging.Formatter):
+	# one json object per line (NDJSON)
+	def format(self, record):
+		entry = {
+			"time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+			"level": record.levelname,
+			"module": record.module,
+			"message": record.getMessage(),
+		}
+		if record.exc_info:
+			entry["exception"] = self.formatException(record.exc_info)
+		return json.dumps(entry, default=str)
+
+def add_to_summary(summary, event, item_path):
+	# summary is {event: paths of items}, or None when nobody reads it
+	if summary is not None:
+		summary.setdefault(event, set()).add(item_path)
+
+def log_summary(summary):
+	for event, message in SUMMARY_MESSAGES.items():
+		if event in summary:
+			logging.info(message.format(len(summary[event])))
+
+def flush_logs():
+	# write out queued log records before printing to stdout ourselves
+	if log_listener:
+		log_listener.stop()
+		log_listener.start()
+
 # ----------------------------------------
 #              User input
 # ----------------------------------------
 def user_confirm(s):
+	flush_logs()
 	print(s)
 	print(f'Do you want to proceed? [y/n] ', end='')
 	while True:
@@ -798,7 +2417,7 @@ def user_confirm(s):
 # 				Main 
 # ----------------------------------------
 
-def process_args():
+def process_args(argv=None):
 	parser = argparse.ArgumentParser(
 		description='`munki-promoter` is a rule-based tool for promoting Munki items between catalogs which, when used with CI, can automate Munki promotions for you.',
 		usage='%(prog)s [options]',
@@ -808,7 +2427,11 @@ def process_args():
 	parser.add_argument('-l', '--list', action='store_true', dest='list',
 						help='Prints the list of possible promotions.')
 	parser.add_argument('-m', '--munki', dest='munki_path', default=MUNKI_PATH,
-						help=f'Optional path to the munki pkginfo directory, defaults to {MUNKI_PATH}')
+						help=f'Optional path to the munki pkginfo directory, defaults to {MUNKI_PATH}. Use s3://bucket/path/to/pkgsinfo for a repo stored in S3.')
+	parser.add_argument('--s3-endpoint-url', dest='s3_endpoint_url',
+					  help='Optional endpoint url for S3-compatible storage such as MinIO.')
+	parser.add_argument('--s3-cache', dest='s3_cache',
+					  help='Optional directory to cache pkgsinfo files read from S3 in, so only changed files are downloaded.')
 	parser.add_argument('--yaml', '-y', dest='config_file',
 					  help=f'Optional path to the configuration yaml file. Defaults to config.yml if not set. If config.yml does not exist, default configuration will be used.')
 	parser.add_argument('--slack', '-s', dest='slack_url',
@@ -823,105 +2446,268 @@ def process_args():
 					  help='Set all missing last edited days to today.')
 	parser.add_argument('--days-before-current-catalog', dest='promote_from_days', type=int,
 					  help='Requires additional command line argument `promotion` to run. For all items that meet the `promote_from` conditions for the given promotion, if the last edit date is unknown it is calculated under the assumption that it took n days to be promoted to the current catalog(s), where n is set by this `days-before-promote-from` argument.')
-	args = parser.parse_args()
+	parser.add_argument('--state-db', dest='state_db',
+					  help='Optional path to a SQLite database to keep the last edit dates of items in, instead of in the pkgsinfo files. Edit dates already in the pkgsinfo files are used for items that are not in the database yet.')
+	parser.add_argument('--import-edit-dates', dest='import_edit', action='store_true',
+					  help='Requires additional command line argument `state-db` to run. Copy the last edit dates in the pkgsinfo files into the state database.')
+	parser.add_argument('--export-edit-dates', dest='export_edit', action='store_true',
+					  help='Requires additional command line argument `state-db` to run. Write the last edit dates in the state database into the pkgsinfo files.')
+	parser.add_argument('--simulate-days', dest='simulate_days', type=int,
+					  help='Show what would be promoted on each of the coming n days without changing anything, assuming munki-promoter runs once a day. Can be combined with `promotion`.')
+	parser.add_argument('--simulate-format', dest='simulate_format', choices=['table', 'json'], default='table',
+					  help='Output format of `simulate-days`, defaults to table.')
+	parser.add_argument('--vectorised', dest='vectorised', action='store_true',
+					  help='Evaluate all promotions at once over a table of all items using NumPy, which is faster for large repos. Only used when no `promotion` is given.')
+	parser.add_argument('--verify-installers', dest='verify_installers', action='store_true',
+					  help='Check that the installer of every item to promote exists and matches its installer_item_hash, and leave out items for which it does not.')
+	parser.add_argument('--pkgs', dest='pkgs_path',
+					  help='Optional path to the munki pkgs directory used by `verify-installers`, defaults to the pkgs directory next to the pkgsinfo directory.')
+	parser.add_argument('--installer-hash-cache', dest='hash_cache', default=HASH_CACHE_FILE,
+					  help=f'Optional path to the SQLite database in which `verify-installers` keeps the hashes of installers, so they are only hashed again when they change. Defaults to {HASH_CACHE_FILE}.')
+	parser.add_argument('--dependencies', dest='dependencies', choices=['ignore', 'hold', 'pull'], default='ignore',
+					  help='How to handle items that `requires` or are an `update_for` items that will not be in their new catalogs. hold leaves them out of the promotion, pull promotes those dependencies along with them if they are in the same catalogs. Defaults to ignore.')
+	parser.add_argument('--journal', dest='journal',
+					  help='Optional path to a journal file in which the planned changes of a promotion run are written before they are applied, and which records every change once it is applied. It can be used with `resume` and `rollback`.')
+	parser.add_argument('--resume', dest='resume',
+					  help='Apply the changes in the given journal that an interrupted run did not apply, without scanning the repo.')
+	parser.add_argument('--rollback', dest='rollback',
+					  help='Restore the catalogs and last edit dates of the items changed by the run in the given journal.')
+	parser.add_argument('--git-commit', dest='git_commit', action='store_true',
+					  help='Commit the files changed by the run to the git repository the munki repo is in, without staging or committing anything else. For promotions the commit message is the markdown summary of the promotions. Can not be combined with `list`, `simulate-days` or `import-edit-dates`, which change no files.')
+	parser.add_argument('--git-branch', dest='git_branch',
+					  help='Requires additional command line argument `git-commit` to run. Create the commit on this new branch instead of the current one, leaving the current branch and index as they are.')
+	parser.add_argument('--pipeline', dest='pipeline', action='store_true',
+					  help='Requires additional command line argument `auto` to run. Read, evaluate and write items at the same time, writing each item as soon as it is found eligible instead of after all items are evaluated. Only used when no `promotion` is given, and can not be combined with `verify-installers`, `dependencies` or `journal`. Items written before an error are not rolled back.')
+	parser.add_argument('--verbose', '-v', dest='verbose', action='count', default=0,
+					  help='Log more detail, such as a line for every item that is changed. Use -vv to include debug output of libraries.')
+	parser.add_argument('--quiet', '-q', dest='quiet', action='count', default=0,
+					  help='Only log warnings and errors. Use -qq to only log errors.')
+	parser.add_argument('--log-format', dest='log_format', choices=['text', 'json'], default='text',
+					  help='Format of log output, defaults to text. Use json to log one json object per line.')
+	parser.add_argument('--lock-repo', dest='lock_repo', action='store_true',
+					  help=f'Hold an exclusive lock on the munki repo for the whole run, waiting for other munki-promoter runs to finish first. By default runs only lock the individual files they write, so different promotions can run in parallel. On S3 a run gives up waiting after {LOCK_TIMEOUT // 60} minutes, and locks older than {LOCK_STALE_AFTER // 60} minutes are assumed to be left over from a run that did not finish.')
+	args = parser.parse_args(argv)
 
-	slack_url = args.slack_url
-	if (not slack_url) and os.environ.get("SLACK_WEBHOOK"):
-		slack_url = os.environ.get("SLACK_WEBHOOK")
-	# return based on config file option
-	if args.config_file:
-		return args.promotion, args.list, args.munki_path, args.config_file, True, slack_url, args.markdown_path, args.auto, args.reset_edit, args.set_edit, args.promote_from_days
-	return args.promotion, args.list, args.munki_path, CONFIG_FILE, False, slack_url, args.markdown_path, args.auto, args.reset_edit, args.set_edit, args.promote_from_days
+	if (not args.slack_url) and os.environ.get("SLACK_WEBHOOK"):
+		args.slack_url = os.environ.get("SLACK_WEBHOOK")
+	# without a config file option, config.yml is used if it exists and the default configuration otherwise
+	args.is_config_specified = bool(args.config_file)
+	if not args.config_file:
+		args.config_file = CONFIG_FILE
+	args.verbosity = args.verbose - args.quiet
+	return args
 
-def setup_logging():
+def setup_logging(verbosity=0, log_format="text"):
+	global log_listener
+	handler = logging.StreamHandler(sys.stdout)
+	if log_format == "json":
+		handler.setFormatter(JsonFormatter())
+	else:
+		handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s (%(module)s): %(message)s", datefmt='%d/%m/%Y %H:%M:%S'))
+	# records are formatted and written by a background thread, so we never wait on the terminal or pipe
+	log_queue = queue.SimpleQueue()
+	log_listener = logging.handlers.QueueListener(log_queue, handler)
+	log_listener.start()
+	# registered before anything else, so it runs last and writes out what is logged by the other exit handlers
+	atexit.register(log_listener.stop)
 	logging.basicConfig(
-		level=logging.DEBUG,
-		format="%(asctime)s - %(levelname)s (%(module)s): %(message)s",
-		datefmt='%d/%m/%Y %H:%M:%S',
-		stream=sys.stdout)
+		level=min(max(logging.INFO - 10 * verbosity, logging.DEBUG), logging.ERROR),
+		handlers=[LogQueueHandler(log_queue)])
+	if verbosity < 2:
+		# libraries log a lot of detail, only show it when explicitly asked for
+		for name in ["boto3", "botocore", "s3transfer", "urllib3"]:
+			logging.getLogger(name).setLevel(max(logging.INFO, logging.getLogger().level))
+
+def describe_promotions(result):
+	s = ""
+	for promotion in result["promotions"]:
+		s += describe_promotion(promotion["promotion"], promotion["promote_to"], promotion["names"], promotion["versions"], promotion["custom_item_descriptions"], promotion["excluded"])
+	return s
+
+def notify_promotions(result, slack_url, md_path):
+	if slack_url:
+		blocks = setup_slack_blocks()
+		for promotion in result["promotions"]:
+			blocks = add_to_slack_blocks(blocks, promotion["promotion"], promotion["promote_to"], promotion["names"], promotion["versions"], promotion["custom_item_descriptions"], promotion["excluded"])
+		send_slack_webhook(slack_url, blocks)
+	if md_path:
+		write_md_file(md_path, md_promotions(result))
+
+def log_excluded(result):
+	excluded = [f"{item['name']} - {item['version']} ({item['reason']})" for promotion in result["promotions"] for item in promotion["excluded"]]
+	logging.warning(f"The following items are eligible but will not be promoted: {and_str(excluded)}")
+
+def md_promotions(result):
+	md = ""
+	for promotion in result["promotions"]:
+		md += md_description(promotion["promotion"], promotion["promote_to"], promotion["names"], promotion["versions"], promotion["custom_item_descriptions"], promotion["excluded"])
+	return md
+
+def commit_promotions(promoter, result, branch=None):
+	# result is what was actually promoted, so skipped items are not in the commit message
+	promoted = len(result["items"])
+	commit_changes(promoter, f"Promote {promoted} {'item' if promoted == 1 else 'items'} with munki-promoter\n\n{md_promotions(result).strip()}\n", branch)
+
+def apply_missing_edit_dates(promoter, result, git_commit=False, branch=None):
+	# for results that are not promoted, the edit dates set for items without one are still written and committed
+	promoter.record_missing_edit_dates(result)
+	if git_commit and result["missing_edit_dates"]:
+		count = len(result["missing_edit_dates"])
+		commit_changes(promoter, f"Set the missing last edit dates of {count} {'item' if count == 1 else 'items'} with munki-promoter\n", branch)
+
+def commit_changes(promoter, message, branch=None):
+	commit = promoter.commit(message, branch)
+	if commit:
+		logging.info(f"Committed the changed files as {commit[:12]}" + (f' on branch "{branch}".' if branch else "."))
+	else:
+		logging.info("No files were changed, nothing to commit.")
 
 def main():
-	setup_logging()
-	promotion, show_list, munki_path, config_path, is_config_specified, slack_url, md_path, auto, reset_edit, set_edit, promote_from_days = process_args()
-	config = get_config(config_path, is_config_specified)
-	check_config(config, config_path)
+	args = process_args()
+	setup_logging(args.verbosity, args.log_format)
+	try:
+		run(args)
+	except PromoterError as e:
+		# only show a traceback when there is an underlying error
+		logging.error(e, exc_info=e.__cause__ is not None)
+		sys.exit(1)
+
+def create_promoter(args):
+	# opens the storage, state database and installer hash cache given on the command line
+	state_store = None
+	if args.state_db:
+		state_store = EditDateStore(args.state_db)
+		atexit.register(state_store.close)
+	hash_cache = None
+	if args.verify_installers:
+		hash_cache = InstallerHashCache(args.hash_cache)
+		atexit.register(hash_cache.close)
+	storage = get_storage(args.munki_path, args.s3_endpoint_url, args.s3_cache)
+	return Promoter(config_path=args.config_file, is_config_specified=args.is_config_specified, storage=storage, state_store=state_store, vectorised=args.vectorised, verify_installers=args.verify_installers, pkgs_path=args.pkgs_path, hash_cache=hash_cache, dependencies=args.dependencies)
+
+def run(args):
+	# args are the parsed command line arguments of process_args
+	if args.pipeline and not args.auto:
+		raise PromoterError("Command line argument `pipeline` must be accompanied by command line argument `auto` to run, but this is not the case.")
+	if args.pipeline and (args.verify_installers or args.dependencies != "ignore" or args.journal):
+		raise PromoterError("Command line argument `pipeline` can not be combined with `verify-installers`, `dependencies` or `journal`, as those need all items to be evaluated before anything is written.")
+	if args.git_branch and not args.git_commit:
+		raise PromoterError("Command line argument `git-branch` must be accompanied by command line argument `git-commit` to run, but this is not the case.")
+	if (args.import_edit or args.export_edit) and not args.state_db:
+		raise PromoterError("Command line arguments `import-edit-dates` and `export-edit-dates` must be accompanied by command line argument `state-db` to run, but this is not the case.")
+	if args.git_commit and (args.import_edit or args.list or args.simulate_days is not None):
+		raise PromoterError("Command line argument `git-commit` can not be combined with `import-edit-dates`, `list` or `simulate-days`, as those do not change any pkgsinfo files.")
+	promoter = create_promoter(args)
+	if args.git_commit:
+		promoter.check_commit(args.git_branch)
+	if args.import_edit or args.reset_edit or args.set_edit or args.promote_from_days or args.export_edit or args.resume or args.rollback or not args.list:
+		promoter.lock(args.lock_repo)
+		# release the repo lock however we exit
+		atexit.register(promoter.storage.close)
+
+	if args.resume or args.rollback:
+		if args.resume:
+			s = f'The changes in journal {args.resume} that have not been applied yet will be applied.'
+		else:
+			s = f'The changes in journal {args.rollback} will be rolled back.'
+		if args.auto or user_confirm(s):
+			if args.resume:
+				applied, skipped = promoter.resume(args.resume)
+				logging.info(f"Applied {len(applied)} remaining changes from journal {args.resume}.")
+				message = f"Apply the remaining changes of journal {os.path.basename(args.resume)} with munki-promoter\n"
+			else:
+				applied, skipped = promoter.rollback(args.rollback)
+				logging.info(f"Rolled back {len(applied)} changes from journal {args.rollback}.")
+				message = f"Roll back the changes of journal {os.path.basename(args.rollback)} with munki-promoter\n"
+			log_skipped(skipped)
+			if args.git_commit:
+				commit_changes(promoter, message, args.git_branch)
+		else:
+			logging.info('Ok, aborted..')
+
+	elif args.import_edit:
+		count = promoter.import_edit_dates()
+		logging.info(f"Imported the last edit dates of {count} items into {args.state_db}.")
 
-	if reset_edit or set_edit or promote_from_days:
-		if reset_edit:
+	elif args.reset_edit or args.set_edit or args.promote_from_days or args.export_edit:
+		if args.reset_edit:
 			logging.info('Reset the last edited day of all items to today.')
-			names, preped_changes = prep_set_edit_date(munki_path, config, overwrite=True)
-		elif set_edit:
+			names, preped_changes = promoter.prep_edit_dates(overwrite=True)
+		elif args.set_edit:
 			logging.info('Setting all missing last edited days to today.')
-			names, preped_changes = prep_set_edit_date(munki_path, config)
-		elif promote_from_days:
-			if not promotion:
-				logging.error("Command line argument `days-before-promote-from` must be accompanied by command line argument `promotion` to run, but this is not the case.")
-				logging.error("For all items that meet the `promote_from` conditions for the given promotion, if the last edit date is unknown but the creation date is known, the last edit date is calculated under the assumption that it took n days to be promoted to the current catalogue(s), where n is set by this `days-before-promote-from` argument.")
-				sys.exit(1)
-			else:
-				logging.info(f'Setting all missing last edited days for items that meet the `promote_from` conditions for "{promotion}", under the assumption that it took {promote_from_days} days to be promoted to the current catalog(s).')
-				names, preped_changes = prep_set_edit_date(munki_path, config, promotion=promotion, promote_from_days=promote_from_days, config_path=config_path)
+			names, preped_changes = promoter.prep_edit_dates()
+		elif args.promote_from_days:
+			names, preped_changes = promoter.prep_edit_dates(promotion=args.promotion, promote_from_days=args.promote_from_days)
+			logging.info(f'Setting all missing last edited days for items that meet the `promote_from` conditions for "{args.promotion}", under the assumption that it took {args.promote_from_days} days to be promoted to the current catalog(s).')
+		elif args.export_edit:
+			logging.info(f'Writing the last edit dates in {args.state_db} to the pkgsinfo files.')
+			names, preped_changes = promoter.prep_export_edit_dates()
 		if names:
 			s = f'The metadata of the following items will be updated: {and_str(names)}'
-			if auto or user_confirm(s):
-				for preped_change in preped_changes:
-					item_path, item = preped_change
-					try_add_metadata(item_path, item)
+			if args.auto or user_confirm(s):
+				log_skipped(promoter.apply_edit_dates(preped_changes, export=args.export_edit))
+				if args.git_commit:
+					commit_changes(promoter, f"Update the last edit dates of {len(names)} {'item' if len(names) == 1 else 'items'} with munki-promoter\n", args.git_branch)
 			else:
 				logging.info('Ok, aborted..')
 		else:
 			logging.info("No metadata need to be updated.")
 
-	elif show_list:
-		print_promotions(config, config_path)
+	elif args.list:
+		flush_logs()
+		print_promotions(promoter.config, args.config_file)
 
-	elif promotion:
-		names, versions, custom_item_descriptions, preped_promotions, promote_to = prep_single_promotion(promotion, config, munki_path, config_path)
-		if names:
-			s = describe_promotion(promotion, promote_to, names, versions, custom_item_descriptions)
-			if auto or user_confirm(s):
-				# apply changes
-				promote_items(preped_promotions)
-				# notify about changes
-				if slack_url:
-					blocks = setup_slack_blocks()
-					blocks = add_to_slack_blocks(blocks, promotion, promote_to, names, versions, custom_item_descriptions)
-					send_slack_webhook(slack_url, blocks)
-				if md_path:
-					md = md_description(promotion, promote_to, names, versions, custom_item_descriptions)
-					write_md_file(md_path, md)
-			else:
-				logging.info('Ok, aborted..')
+	elif args.simulate_days is not None:
+		schedule = promoter.simulate(args.simulate_days, promotion=args.promotion)
+		flush_logs()
+		if args.simulate_format == "json":
+			print(json.dumps(schedule, indent=2))
 		else:
+			print(describe_simulation(schedule))
+
+	elif args.pipeline and not args.promotion:
+		result, skipped = promoter.promote_pipelined()
+		log_skipped(skipped)
+		if result["items"]:
+			# notify about changes
+			notify_promotions(result, args.slack_url, args.markdown_path)
+			if args.git_commit:
+				commit_promotions(promoter, result, args.git_branch)
+		elif not skipped:
 			logging.info("No items need to be promoted.")
 
 	else:
-		names_dict, versions_dict, custom_item_descriptions_dict, preped_promotions, promote_tos = prep_all_promotions(config, munki_path, config_path)
-		if len(names_dict) > 0:
-			s = ""
-			for promotion in config["promotions"]: # present promotions in order of config file
-				if promotion in names_dict:
-					s += describe_promotion(promotion, promote_tos[promotion], names_dict[promotion], versions_dict[promotion], custom_item_descriptions_dict[promotion])
-			if auto or user_confirm(s):
+		if args.promotion:
+			result = promoter.prep_promotion(args.promotion)
+			# a single promotion only goes ahead when it has items that are not custom items
+			has_items = any(described["names"] for described in result["promotions"])
+		else:
+			result = promoter.prep_all_promotions()
+			# promotions of which every item was excluded are still listed, to report why
+			has_items = len(result["items"]) > 0
+		if has_items:
+			s = describe_promotions(result)
+			if args.auto or user_confirm(s):
 				# apply changes
-				promote_items(preped_promotions)
-				# notify about changes
-				if slack_url:
-					blocks = setup_slack_blocks()
-					for promotion in config["promotions"]: # present promotions in order of config file
-						if promotion in names_dict:
-							blocks = add_to_slack_blocks(blocks, promotion, promote_tos[promotion], names_dict[promotion], versions_dict[promotion], custom_item_descriptions_dict[promotion])
-					send_slack_webhook(slack_url, blocks)
-				if md_path:
-					md = ""
-					for promotion in config["promotions"]: # present promotions in order of config file
-						if promotion in names_dict:
-							md += md_description(promotion, promote_tos[promotion], names_dict[promotion], versions_dict[promotion], custom_item_descriptions_dict[promotion])
-					write_md_file(md_path, md)
+				promoted, skipped = promoter.promote(result, args.journal)
+				log_skipped(skipped)
+				# notify about the changes that were made and the items that were left out
+				if promoted["items"] or promoted["excluded"]:
+					notify_promotions(promoted, args.slack_url, args.markdown_path)
+				if args.git_commit:
+					commit_promotions(promoter, promoted, args.git_branch)
 			else:
+				apply_missing_edit_dates(promoter, result, args.git_commit, args.git_branch)
 				logging.info('Ok, aborted..')
 		else:
+			apply_missing_edit_dates(promoter, result, args.git_commit, args.git_branch)
 			logging.info("No items need to be promoted.")
+			if result["excluded"]:
+				# report why eligible items were left out, without the custom items of a single promotion that did not run
+				excluded = describe_records([], [described["promotion"] for described in result["promotions"]], result["excluded"])
+				log_excluded(excluded)
+				notify_promotions(excluded, args.slack_url, args.markdown_path)
+	log_summary(promoter.summary)
 
 if __name__ == '__main__':
-	main()
\ No newline at end of file
+	main()
@@ -0,0 +1,59 @@
+import copy
+import datetime
+import importlib.util
+import os
+import plistlib
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIG = {
+	"promotions": {
+		"autopkg": {
+			"promote_to": ["staging", "autopkg"],
+			"days_in_catalog": 3 },
+		"staging": {
+			"promote_from": ["staging", "autopkg"],
+			"promote_to": ["production"],
+			"days_in_catalog": 5 } },
+	"default_days_in_catalog": 7 }
+
+@pytest.fixture(scope="session")
+def mp():
+	# munki-promoter.py is a script, so load it by path
+	spec = importlib.util.spec_from_file_location("munki_promoter", os.path.join(ROOT, "munki-promoter.py"))
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+@pytest.fixture
+def config():
+	return copy.deepcopy(CONFIG)
+
+@pytest.fixture
+def pkgsinfo(tmp_path):
+	path = tmp_path / "repo" / "pkgsinfo"
+	path.mkdir(parents=True)
+	return str(path)
+
+@pytest.fixture
+def make_pkginfo(pkgsinfo):
+	# writes a pkginfo file and returns its path, dates are given in days before now
+	def make_pkginfo(name, version, catalogs, edited=None, created=None, **keys):
+		now = datetime.datetime.now().replace(microsecond=0)
+		item = {"name": name, "version": version, "catalogs": catalogs, "_metadata": dict()}
+		if edited is not None:
+			item["_metadata"]["munki-promoter_edit_date"] = now - datetime.timedelta(days=edited)
+		if created is not None:
+			item["_metadata"]["creation_date"] = now - datetime.timedelta(days=created)
+		item.update(keys)
+		path = os.path.join(pkgsinfo, f"{name}-{version}.plist")
+		with open(path, "wb") as fp:
+			plistlib.dump(item, fp)
+		return path
+	return make_pkginfo
+
+def read_pkginfo(path):
+	with open(path, "rb") as fp:
+		return plistlib.load(fp)
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+import yaml
+
+from conftest import read_pkginfo
+
+@pytest.fixture
+def config_file(tmp_path, config):
+	path = str(tmp_path / "config.yml")
+	with open(path, "w") as fp:
+		yaml.safe_dump(config, fp)
+	return path
+
+def test_process_args(mp, monkeypatch):
+	monkeypatch.delenv("SLACK_WEBHOOK", raising=False)
+	args = mp.process_args(["-a", "-vv", "-q"])
+	assert args.config_file == mp.CONFIG_FILE
+	assert not args.is_config_specified
+	assert args.verbosity == 1
+	monkeypatch.setenv("SLACK_WEBHOOK", "https://hooks.example.com/webhook")
+	args = mp.process_args(["-y", "promoter.yml"])
+	assert args.config_file == "promoter.yml"
+	assert args.is_config_specified
+	assert args.slack_url == "https://hooks.example.com/webhook"
+
+def test_run_promotes(mp, pkgsinfo, make_pkginfo, config_file, tmp_path):
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	md_path = str(tmp_path / "promotions.md")
+	mp.run(mp.process_args(["-a", "-m", pkgsinfo, "-y", config_file, "--markdown", md_path]))
+	assert read_pkginfo(firefox)["catalogs"] == ["staging", "autopkg"]
+	with open(md_path) as fp:
+		assert "- Firefox: 1.0" in fp.read()
+
+def test_run_rejects_git_branch_without_commit(mp, pkgsinfo, config_file):
+	with pytest.raises(mp.PromoterError):
+		mp.run(mp.process_args(["-a", "-m", pkgsinfo, "-y", config_file, "--git-branch", "promotions"]))
+	assert os.listdir(pkgsinfo) == []
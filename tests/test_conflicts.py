@@ -0,0 +1,73 @@
+import os
+import plistlib
+import subprocess
+import sys
+
+from conftest import read_pkginfo
+
+def write_pkginfo(path, item):
+	with open(path, "wb") as fp:
+		plistlib.dump(item, fp)
+
+def prep(mp, config, pkgsinfo):
+	promoter = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml")
+	return promoter, promoter.prep_all_promotions()
+
+def test_changed_item_no_longer_eligible_is_skipped(mp, config, pkgsinfo, make_pkginfo):
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	make_pkginfo("Slack", "4.0", ["autopkg"], edited=10)
+	promoter, result = prep(mp, config, pkgsinfo)
+	# another process promotes the item in the meantime
+	item = read_pkginfo(firefox)
+	item["catalogs"] = ["production"]
+	write_pkginfo(firefox, item)
+	promoted, skipped = promoter.promote(result)
+	assert skipped == [firefox]
+	assert read_pkginfo(firefox)["catalogs"] == ["production"]
+	assert [path for path, _ in promoted["items"]] == [os.path.join(pkgsinfo, "Slack-4.0.plist")]
+	assert promoted["promotions"][0]["names"] == ["Slack"]
+
+def test_changed_item_is_reevaluated(mp, config, pkgsinfo, make_pkginfo):
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	promoter, result = prep(mp, config, pkgsinfo)
+	item = read_pkginfo(firefox)
+	item["notes"] = "changed by someone else"
+	write_pkginfo(firefox, item)
+	promoted, skipped = promoter.promote(result)
+	assert skipped == []
+	assert read_pkginfo(firefox)["catalogs"] == ["staging", "autopkg"]
+	assert read_pkginfo(firefox)["notes"] == "changed by someone else"
+	assert promoted["items"][0][1]["notes"] == "changed by someone else"
+	assert promoter.summary["reevaluated"] == {firefox}
+
+def test_reevaluated_item_is_reported_under_its_new_promotion(mp, config, pkgsinfo, make_pkginfo):
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	promoter, result = prep(mp, config, pkgsinfo)
+	assert [promotion["promotion"] for promotion in result["promotions"]] == ["autopkg"]
+	item = read_pkginfo(firefox)
+	item["catalogs"] = ["staging", "autopkg"]
+	write_pkginfo(firefox, item)
+	promoted, skipped = promoter.promote(result)
+	assert skipped == []
+	assert read_pkginfo(firefox)["catalogs"] == ["production"]
+	assert [promotion["promotion"] for promotion in promoted["promotions"]] == ["staging"]
+
+def test_locked_item_is_skipped(mp, config, pkgsinfo, make_pkginfo, monkeypatch):
+	monkeypatch.setattr(mp, "LOCK_RETRY_DELAY", 0)
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	promoter, result = prep(mp, config, pkgsinfo)
+	# fcntl locks are per process, so the lock has to be held by another one
+	holder = subprocess.Popen([sys.executable, "-c", (
+		"import fcntl, sys\n"
+		f"fp = open({firefox!r}, 'rb+')\n"
+		"fcntl.lockf(fp, fcntl.LOCK_EX)\n"
+		"print('locked', flush=True)\n"
+		"sys.stdin.read()\n")], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+	try:
+		assert holder.stdout.readline().strip() == "locked"
+		promoted, skipped = promoter.promote(result)
+	finally:
+		holder.communicate("")
+	assert skipped == [firefox]
+	assert promoted["items"] == []
+	assert read_pkginfo(firefox)["catalogs"] == ["autopkg"]
@@ -0,0 +1,99 @@
+import os
+
+import pytest
+
+from conftest import read_pkginfo
+
+def prep(mp, config, pkgsinfo, dependencies):
+	promoter = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml", dependencies=dependencies)
+	return promoter.prep_all_promotions()
+
+def promoted_names(result):
+	return sorted(item["name"] for _, item in result["items"])
+
+def excluded(result):
+	return sorted((item["name"], item["reason"]) for promotion in result["promotions"] for item in promotion["excluded"])
+
+def test_dependency_graph_lookup(mp):
+	graph = mp.DependencyGraph([
+		("Lib-1.plist", {"name": "Lib", "version": "1"}),
+		("Lib-2.plist", {"name": "Lib", "version": "2"}),
+		("App-1.plist", {"name": "App", "version": "1", "requires": ["Lib-2"], "update_for": "Base"}),
+	])
+	assert sorted(graph.lookup("Lib")) == ["Lib-1.plist", "Lib-2.plist"]
+	assert graph.lookup("Lib-2") == ["Lib-2.plist"]
+	assert graph.lookup("Lib--1") == ["Lib-1.plist"]
+	assert graph.get_dependencies(graph.items["App-1.plist"]) == [("requires", "Lib-2"), ("is an update for", "Base")]
+
+def test_hold(mp, config, pkgsinfo, make_pkginfo):
+	make_pkginfo("App", "1", ["autopkg"], edited=10, requires=["Lib"])
+	make_pkginfo("Lib", "1", ["autopkg"], edited=1)
+	result = prep(mp, config, pkgsinfo, "hold")
+	assert promoted_names(result) == []
+	assert excluded(result) == [("App", "requires Lib, which will not be in the staging and autopkg catalog(s)")]
+	assert promoted_names(prep(mp, config, pkgsinfo, "ignore")) == ["App"]
+
+def test_hold_chain(mp, config, pkgsinfo, make_pkginfo):
+	# A needs B needs C, and C is not eligible yet, so B and then A are held back
+	make_pkginfo("A", "1", ["autopkg"], edited=10, requires=["B"])
+	make_pkginfo("B", "1", ["autopkg"], edited=10, requires=["C"])
+	make_pkginfo("C", "1", ["autopkg"], edited=1)
+	make_pkginfo("D", "1", ["autopkg"], edited=10)
+	result = prep(mp, config, pkgsinfo, "hold")
+	assert promoted_names(result) == ["D"]
+	assert [name for name, _ in excluded(result)] == ["A", "B"]
+
+def test_dependencies_on_each_other_are_promoted_together(mp, config, pkgsinfo, make_pkginfo):
+	make_pkginfo("A", "1", ["autopkg"], edited=10, requires=["B"])
+	make_pkginfo("B", "1", ["autopkg"], edited=10, update_for=["A"])
+	assert promoted_names(prep(mp, config, pkgsinfo, "hold")) == ["A", "B"]
+
+def test_pull(mp, config, pkgsinfo, make_pkginfo):
+	app = make_pkginfo("App", "1", ["autopkg"], edited=10, requires=["Lib"])
+	make_pkginfo("Lib", "1", ["autopkg"], edited=1)
+	lib = make_pkginfo("Lib", "2", ["autopkg"], edited=1)
+	promoter = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml", dependencies="pull")
+	result = promoter.prep_all_promotions()
+	# the newest version of the dependency is pulled along
+	assert sorted(path for path, _ in result["items"]) == [app, lib]
+	assert promoter.summary["pulled"] == {lib}
+	promoter.promote(result)
+	assert read_pkginfo(lib)["catalogs"] == ["staging", "autopkg"]
+	assert read_pkginfo(os.path.join(pkgsinfo, "Lib-1.plist"))["catalogs"] == ["autopkg"]
+
+def test_pull_respects_selections(mp, config, pkgsinfo, make_pkginfo):
+	config["selections"] = [{"type": "exclusion", "key": "name", "values": ["Lib"]}]
+	mp.check_config(config, "config.yml")
+	make_pkginfo("App", "1", ["autopkg"], edited=10, requires=["Lib"])
+	make_pkginfo("Lib", "1", ["autopkg"], edited=1)
+	result = prep(mp, config, pkgsinfo, "pull")
+	assert promoted_names(result) == []
+	assert [name for name, _ in excluded(result)] == ["App"]
+
+@pytest.mark.parametrize("explicit", [False, True])
+def test_implicit_promote_from(mp, pkgsinfo, make_pkginfo, explicit):
+	# without promote_from a promotion promotes from the catalog of its own name
+	config = {
+		"promotions": {
+			"dev": {"promote_to": ["autopkg"]},
+			"autopkg": {"promote_to": ["staging"]} },
+		"default_days_in_catalog": 3 }
+	if explicit:
+		config["promotions"]["dev"]["promote_from"] = ["dev"]
+		config["promotions"]["autopkg"]["promote_from"] = ["autopkg"]
+	mp.check_config(config, "config.yml")
+	make_pkginfo("App", "1", ["dev"], edited=10, requires=["Lib"])
+	make_pkginfo("Lib", "1", ["staging"], edited=10)
+	result = prep(mp, config, pkgsinfo, "hold")
+	assert promoted_names(result) == ["App"]
+	assert excluded(result) == []
+
+def test_custom_item_promotion_counts_downstream(mp, pkgsinfo, make_pkginfo):
+	# Tool skips testing, so items in testing can rely on what is in production
+	config = {
+		"promotions": {
+			"testing": {"promote_to": ["production"], "custom_items": {"Tool": {"promote_to": ["archive"]}}},
+			"dev": {"promote_to": ["testing"]} },
+		"default_days_in_catalog": 3 }
+	mp.check_config(config, "config.yml")
+	assert mp.get_downstream_catalogs(config, "config.yml")["testing"] == {"testing", "production", "archive"}
@@ -0,0 +1,74 @@
+import datetime
+import os
+import plistlib
+
+import pytest
+import yaml
+
+from conftest import read_pkginfo
+
+@pytest.fixture
+def config_file(tmp_path, config):
+	path = str(tmp_path / "config.yml")
+	with open(path, "w") as fp:
+		yaml.safe_dump(config, fp)
+	return path
+
+def remove_edit_date(path):
+	item = read_pkginfo(path)
+	del item["_metadata"]["munki-promoter_edit_date"]
+	with open(path, "wb") as fp:
+		plistlib.dump(item, fp)
+
+def test_import_export_round_trip(mp, pkgsinfo, make_pkginfo, config_file, tmp_path):
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	slack = make_pkginfo("Slack", "4.0", ["autopkg"], edited=2)
+	undated = make_pkginfo("Zoom", "5", ["autopkg"])
+	dates = {path: read_pkginfo(path)["_metadata"]["munki-promoter_edit_date"] for path in [firefox, slack]}
+	state_db = str(tmp_path / "state.db")
+	mp.run(mp.process_args(["-m", pkgsinfo, "-y", config_file, "--state-db", state_db, "--import-edit-dates"]))
+	for path in [firefox, slack]:
+		remove_edit_date(path)
+	mp.run(mp.process_args(["-a", "-m", pkgsinfo, "-y", config_file, "--state-db", state_db, "--export-edit-dates"]))
+	for path, date in dates.items():
+		assert read_pkginfo(path)["_metadata"]["munki-promoter_edit_date"] == date
+		assert read_pkginfo(path)["catalogs"] == ["autopkg"]
+	assert not "munki-promoter_edit_date" in read_pkginfo(undated)["_metadata"]
+
+def test_export_skips_items_that_are_up_to_date(mp, config, pkgsinfo, make_pkginfo, tmp_path):
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	slack = make_pkginfo("Slack", "4.0", ["autopkg"], edited=2)
+	state_store = mp.EditDateStore(str(tmp_path / "state.db"))
+	promoter = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml", state_store=state_store)
+	assert promoter.import_edit_dates() == 2
+	assert promoter.prep_export_edit_dates() == ([], [])
+	newer = datetime.datetime.now().replace(microsecond=0)
+	state_store.set_edit_date(slack, read_pkginfo(slack), newer)
+	names, changes = promoter.prep_export_edit_dates()
+	assert names == ["Slack"]
+	assert promoter.apply_edit_dates(changes, export=True) == []
+	assert read_pkginfo(slack)["_metadata"]["munki-promoter_edit_date"] == newer
+	assert read_pkginfo(firefox)["_metadata"]["munki-promoter_edit_date"] != newer
+
+def test_import_export_require_state_db(mp, pkgsinfo, config_file):
+	with pytest.raises(mp.PromoterError):
+		mp.run(mp.process_args(["-m", pkgsinfo, "-y", config_file, "--import-edit-dates"]))
+
+def test_renamed_item_keeps_edit_date(mp, make_pkginfo, tmp_path):
+	path = make_pkginfo("Firefox", "1.0", ["autopkg"])
+	item = read_pkginfo(path)
+	edit_date = datetime.datetime(2024, 5, 1, 12, 0)
+	state_store = mp.EditDateStore(str(tmp_path / "state.db"))
+	state_store.set_edit_date(path, item, edit_date)
+	state_store.close()
+	state_store = mp.EditDateStore(str(tmp_path / "state.db"))
+	renamed = os.path.join(os.path.dirname(path), "apps", "Firefox-1.0__1.plist")
+	# promoting changes the catalogs and metadata, but not the content hash
+	item["catalogs"] = ["staging", "autopkg"]
+	item["_metadata"]["munki-promoter_edit_date"] = datetime.datetime(2024, 6, 1)
+	assert state_store.get_edit_date(renamed, item) == edit_date
+	assert mp.get_edit_date(item, renamed, state_store) == edit_date
+	changed = dict(item, description="A different build")
+	assert state_store.get_edit_date(renamed, changed) is None
+	assert state_store.get_edit_date(renamed, dict(item, version="1.1")) is None
+	state_store.close()
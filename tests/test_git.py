@@ -0,0 +1,159 @@
+import datetime
+import os
+import plistlib
+import subprocess
+import sys
+import tempfile
+
+import pytest
+import yaml
+
+from conftest import read_pkginfo
+
+def git(cwd, *args):
+	return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()
+
+@pytest.fixture
+def repo(tmp_path, pkgsinfo):
+	root = str(tmp_path / "repo")
+	git(root, "init", "-q", "-b", "main")
+	git(root, "config", "user.name", "Test")
+	git(root, "config", "user.email", "test@example.com")
+	readme = os.path.join(root, "README")
+	with open(readme, "w") as fp:
+		fp.write("munki repo\n")
+	git(root, "add", "README")
+	git(root, "commit", "-q", "-m", "Initial commit")
+	return root
+
+def test_git_commit_paths_only_commits_given_paths(mp, repo, pkgsinfo, make_pkginfo):
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"])
+	other = make_pkginfo("Slack", "4.0", ["autopkg"])
+	# something else the user has staged is left alone
+	git(repo, "add", other)
+	commit = mp.git_commit_paths([firefox], "Promote Firefox\n", pkgsinfo)
+	assert git(repo, "rev-parse", "HEAD") == commit
+	assert git(repo, "show", "--name-only", "--format=%s", "HEAD").splitlines() == ["Promote Firefox", "", "pkgsinfo/Firefox-1.0.plist"]
+	assert git(repo, "diff", "--cached", "--name-only") == "pkgsinfo/Slack-4.0.plist"
+	assert git(repo, "diff", "--name-only") == ""
+
+def test_git_commit_paths_on_branch(mp, repo, pkgsinfo, make_pkginfo):
+	head = git(repo, "rev-parse", "HEAD")
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"])
+	commit = mp.git_commit_paths([firefox], "Promote Firefox\n", pkgsinfo, branch="promotions")
+	assert git(repo, "rev-parse", "HEAD") == head
+	assert git(repo, "rev-parse", "promotions") == commit
+	assert git(repo, "rev-parse", "promotions^") == head
+	with pytest.raises(mp.PromoterError):
+		mp.git_commit_paths([firefox], "Promote Firefox\n", pkgsinfo, branch="promotions")
+	with pytest.raises(mp.PromoterError):
+		mp.git_commit_paths([firefox], "Promote Firefox\n", pkgsinfo, branch="not a branch")
+
+def test_git_commit_paths_outside_repo(mp, repo, pkgsinfo, tmp_path):
+	outside = tmp_path / "outside.plist"
+	outside.write_bytes(b"")
+	with pytest.raises(mp.PromoterError):
+		mp.git_commit_paths([str(outside)], "Promote\n", pkgsinfo)
+
+def test_commit_promotions_leaves_out_skipped_items(mp, config, repo, pkgsinfo, make_pkginfo):
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	slack = make_pkginfo("Slack", "4.0", ["autopkg"], edited=10)
+	git(repo, "add", "pkgsinfo")
+	git(repo, "commit", "-q", "-m", "Add items")
+	promoter = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml")
+	result = promoter.prep_all_promotions()
+	# another process changes Slack so it is no longer eligible
+	item = read_pkginfo(slack)
+	item["catalogs"] = ["production"]
+	with open(slack, "wb") as fp:
+		plistlib.dump(item, fp)
+	promoted, skipped = promoter.promote(result)
+	assert skipped == [slack]
+	mp.commit_promotions(promoter, promoted)
+	message = git(repo, "log", "-1", "--format=%B")
+	assert message.startswith("Promote 1 item with munki-promoter")
+	assert "Firefox" in message
+	assert not "Slack" in message
+	assert git(repo, "show", "--name-only", "--format=", "HEAD") == os.path.relpath(firefox, repo)
+
+@pytest.fixture
+def config_file(tmp_path, config):
+	path = str(tmp_path / "config.yml")
+	with open(path, "w") as fp:
+		yaml.safe_dump(config, fp)
+	return path
+
+def test_run_commits_after_notifying(mp, repo, pkgsinfo, make_pkginfo, config_file, tmp_path):
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	git(repo, "add", "pkgsinfo")
+	git(repo, "commit", "-q", "-m", "Add items")
+	md_path = str(tmp_path / "promotions.md")
+	mp.run(mp.process_args(["-a", "-m", pkgsinfo, "-y", config_file, "--git-commit", "--markdown", md_path]))
+	assert read_pkginfo(firefox)["catalogs"] == ["staging", "autopkg"]
+	assert os.path.exists(md_path)
+	assert git(repo, "log", "-1", "--format=%s") == "Promote 1 item with munki-promoter"
+	assert git(repo, "status", "--porcelain") == ""
+
+@pytest.mark.parametrize("extra_args", [[], ["--git-branch", "main"], ["--git-branch", "not a branch"]])
+def test_run_checks_git_before_writing(mp, pkgsinfo, make_pkginfo, config_file, tmp_path, request, extra_args):
+	if extra_args:
+		# a branch that exists or an invalid name, otherwise no git repo at all
+		request.getfixturevalue("repo")
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	md_path = str(tmp_path / "promotions.md")
+	with pytest.raises(mp.PromoterError):
+		mp.run(mp.process_args(["-a", "-m", pkgsinfo, "-y", config_file, "--git-commit", "--markdown", md_path] + extra_args))
+	assert read_pkginfo(firefox)["catalogs"] == ["autopkg"]
+	assert not os.path.exists(md_path)
+
+def test_run_commits_edit_dates_and_rollback(mp, repo, pkgsinfo, make_pkginfo, config_file, tmp_path):
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"])
+	git(repo, "add", "pkgsinfo")
+	git(repo, "commit", "-q", "-m", "Add items")
+	mp.run(mp.process_args(["-a", "-m", pkgsinfo, "-y", config_file, "--git-commit", "--reset-edit-date"]))
+	assert "munki-promoter_edit_date" in read_pkginfo(firefox)["_metadata"]
+	assert git(repo, "log", "-1", "--format=%s") == "Update the last edit dates of 1 item with munki-promoter"
+	item = read_pkginfo(firefox)
+	item["_metadata"]["munki-promoter_edit_date"] -= datetime.timedelta(days=10)
+	with open(firefox, "wb") as fp:
+		plistlib.dump(item, fp)
+	git(repo, "commit", "-q", "-am", "Backdate")
+	journal = str(tmp_path / "journal.jsonl")
+	mp.run(mp.process_args(["-a", "-m", pkgsinfo, "-y", config_file, "--git-commit", "--journal", journal]))
+	mp.run(mp.process_args(["-a", "-m", pkgsinfo, "-y", config_file, "--git-commit", "--rollback", journal]))
+	assert read_pkginfo(firefox)["catalogs"] == ["autopkg"]
+	assert git(repo, "log", "-1", "--format=%s") == "Roll back the changes of journal journal.jsonl with munki-promoter"
+	assert git(repo, "status", "--porcelain") == ""
+
+def test_run_rejects_git_commit_without_changes(mp, repo, pkgsinfo, config_file):
+	with pytest.raises(mp.PromoterError):
+		mp.run(mp.process_args(["-m", pkgsinfo, "-y", config_file, "--git-commit", "--simulate-days", "3"]))
+
+def test_lock_file_is_kept_out_of_the_repo(mp, repo, pkgsinfo, make_pkginfo):
+	make_pkginfo("Firefox", "1.0", ["autopkg"])
+	git(repo, "add", "pkgsinfo")
+	git(repo, "commit", "-q", "-m", "Add items")
+	storage = mp.LocalStorage(pkgsinfo)
+	storage.lock_repo(exclusive=True)
+	try:
+		assert os.path.dirname(storage.get_lock_path()) == os.path.join(os.path.realpath(repo), ".git")
+		assert git(repo, "status", "--porcelain") == ""
+		# another process can not take the lock while this run holds it
+		locked = subprocess.run([sys.executable, "-c", (
+			"import fcntl, sys\n"
+			f"fp = open({storage.get_lock_path()!r}, 'a+')\n"
+			"try:\n"
+			"	fcntl.lockf(fp, fcntl.LOCK_SH | fcntl.LOCK_NB)\n"
+			"except OSError:\n"
+			"	sys.exit(1)\n")])
+		assert locked.returncode == 1
+	finally:
+		storage.close()
+
+def test_lock_file_without_git(mp, pkgsinfo):
+	storage = mp.LocalStorage(pkgsinfo)
+	assert os.path.dirname(storage.get_lock_path()) == tempfile.gettempdir()
+	assert storage.get_lock_path() != mp.LocalStorage(os.path.dirname(pkgsinfo)).get_lock_path()
+	storage.lock_repo(exclusive=False)
+	storage.close()
+	assert os.listdir(pkgsinfo) == []
@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from conftest import read_pkginfo
+
+class Interrupted(BaseException):
+	pass
+
+@pytest.fixture
+def items(pkgsinfo, make_pkginfo):
+	# promoted with its creation date, promoted with its edit date, and only given an edit date
+	paths = [
+		make_pkginfo("Firefox", "1.0", ["autopkg"], created=10),
+		make_pkginfo("Slack", "4.0", ["staging", "autopkg"], edited=10),
+		make_pkginfo("Zoom", "5", ["autopkg"]),
+	]
+	return {path: read_pkginfo(path) for path in paths}
+
+def interrupt_at(mp, monkeypatch, interrupted_path):
+	write_item = mp.write_item
+	def interrupt(storage, item_path, *args):
+		if item_path == interrupted_path:
+			raise Interrupted()
+		return write_item(storage, item_path, *args)
+	monkeypatch.setattr(mp, "write_item", interrupt)
+
+def test_rollback_restores_items(mp, config, pkgsinfo, items, tmp_path):
+	journal = str(tmp_path / "journal.jsonl")
+	promoter = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml")
+	promoted, skipped = promoter.promote(promoter.prep_all_promotions(), journal)
+	assert len(promoted["items"]) == 2
+	assert "munki-promoter_edit_date" in read_pkginfo(os.path.join(pkgsinfo, "Zoom-5.plist"))["_metadata"]
+	rolled_back, skipped = promoter.rollback(journal)
+	assert sorted(rolled_back) == sorted(items)
+	assert skipped == []
+	assert {path: read_pkginfo(path) for path in items} == items
+
+def test_rollback_restores_state_store(mp, config, pkgsinfo, items, tmp_path):
+	journal = str(tmp_path / "journal.jsonl")
+	state_store = mp.EditDateStore(str(tmp_path / "state.db"))
+	promoter = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml", state_store=state_store)
+	promoter.promote(promoter.prep_all_promotions(), journal)
+	assert all(state_store.get_edit_date(path, read_pkginfo(path)) for path in items)
+	promoter.rollback(journal)
+	assert {path: read_pkginfo(path)["catalogs"] for path in items} == {path: item["catalogs"] for path, item in items.items()}
+	assert {path: mp.get_edit_date(read_pkginfo(path), path, state_store) for path in items} == \
+		{path: item["_metadata"].get("munki-promoter_edit_date") for path, item in items.items()}
+
+def test_resume_finishes_interrupted_run(mp, config, pkgsinfo, items, tmp_path, monkeypatch):
+	journal = str(tmp_path / "journal.jsonl")
+	slack = os.path.join(pkgsinfo, "Slack-4.0.plist")
+	promoter = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml")
+	result = promoter.prep_all_promotions()
+	with monkeypatch.context() as patch:
+		interrupt_at(mp, patch, slack)
+		with pytest.raises(Interrupted):
+			promoter.promote(result, journal)
+	assert read_pkginfo(slack)["catalogs"] == ["staging", "autopkg"]
+	# an unfinished journal blocks the next run
+	with pytest.raises(mp.PromoterError):
+		promoter.promote(promoter.prep_all_promotions(), journal)
+	applied, skipped = promoter.resume(journal)
+	assert slack in applied
+	assert skipped == []
+	assert read_pkginfo(slack)["catalogs"] == ["production"]
+	assert read_pkginfo(os.path.join(pkgsinfo, "Firefox-1.0.plist"))["catalogs"] == ["staging", "autopkg"]
+	assert "munki-promoter_edit_date" in read_pkginfo(os.path.join(pkgsinfo, "Zoom-5.plist"))["_metadata"]
+	# and can then be rolled back as a whole
+	promoter.rollback(journal)
+	assert {path: read_pkginfo(path) for path in items} == items
@@ -0,0 +1,84 @@
+import json
+import logging
+
+import pytest
+
+LIBRARIES = ["boto3", "botocore", "s3transfer", "urllib3"]
+
+@pytest.fixture
+def setup_logging(mp, monkeypatch):
+	# run setup_logging against a bare root logger and undo it afterwards, pytest keeps its own handlers on the root logger
+	root = logging.getLogger()
+	handlers, level = root.handlers[:], root.level
+	library_levels = {name: logging.getLogger(name).level for name in LIBRARIES}
+	exit_handlers = []
+	monkeypatch.setattr(mp.atexit, "register", exit_handlers.append)
+	monkeypatch.setattr(mp, "log_listener", None)
+	def setup_logging(verbosity=0, log_format="text"):
+		for handler in root.handlers[:]:
+			root.removeHandler(handler)
+		mp.setup_logging(verbosity, log_format)
+	yield setup_logging
+	for handler in exit_handlers:
+		handler()
+	for handler in root.handlers[:]:
+		root.removeHandler(handler)
+	for handler in handlers:
+		root.addHandler(handler)
+	root.setLevel(level)
+	for name, library_level in library_levels.items():
+		logging.getLogger(name).setLevel(library_level)
+
+@pytest.mark.parametrize("verbosity, level", [
+	(0, logging.INFO),
+	(1, logging.DEBUG),
+	(5, logging.DEBUG),
+	(-1, logging.WARNING),
+	(-2, logging.ERROR),
+	(-5, logging.ERROR)])
+def test_verbosity_is_clamped(mp, setup_logging, verbosity, level):
+	setup_logging(verbosity)
+	assert logging.getLogger().level == level
+
+@pytest.mark.parametrize("verbosity, level", [
+	(-2, logging.ERROR),
+	(0, logging.INFO),
+	(1, logging.INFO),
+	(2, logging.DEBUG)])
+def test_library_logs_need_vv(mp, setup_logging, verbosity, level):
+	setup_logging(verbosity)
+	assert all(logging.getLogger(name).getEffectiveLevel() == level for name in LIBRARIES)
+
+def test_json_format(mp, setup_logging, capsys):
+	setup_logging(0, "json")
+	logging.debug("hidden")
+	logging.info("Promoted %d items", 3)
+	try:
+		raise mp.PromoterError("broken")
+	except mp.PromoterError:
+		logging.exception("Could not promote")
+	mp.flush_logs()
+	entries = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+	assert [(entry["level"], entry["message"]) for entry in entries] == [("INFO", "Promoted 3 items"), ("ERROR", "Could not promote")]
+	assert all(entry["module"] == "test_logging" and entry["time"].endswith("+00:00") for entry in entries)
+	assert not "exception" in entries[0]
+	assert "PromoterError: broken" in entries[1]["exception"]
+
+def test_flush_logs(mp, setup_logging, capsys):
+	setup_logging()
+	for i in range(100):
+		logging.info(f"record {i}")
+	mp.flush_logs()
+	print("printed")
+	lines = capsys.readouterr().out.splitlines()
+	assert len(lines) == 101
+	assert lines[-2].endswith("INFO (test_logging): record 99")
+	assert lines[-1] == "printed"
+	# the listener is running again after flushing
+	logging.info("after")
+	mp.flush_logs()
+	assert capsys.readouterr().out.endswith("INFO (test_logging): after\n")
+
+def test_flush_logs_without_setup(mp, monkeypatch):
+	monkeypatch.setattr(mp, "log_listener", None)
+	mp.flush_logs()
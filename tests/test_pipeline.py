@@ -0,0 +1,71 @@
+import os
+import shutil
+import threading
+
+from conftest import read_pkginfo
+
+class Stop(BaseException):
+	pass
+
+def make_items(make_pkginfo):
+	make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	make_pkginfo("Firefox", "2.0", ["autopkg"], edited=1)
+	make_pkginfo("Slack", "4.0", ["staging", "autopkg"], edited=10)
+	make_pkginfo("Zoom", "5", ["autopkg"])
+	make_pkginfo("Chrome", "1", ["autopkg"], created=10)
+	make_pkginfo("Office", "16", ["production"], edited=10)
+
+def catalogs(path):
+	return {file: read_pkginfo(os.path.join(path, file))["catalogs"] for file in sorted(os.listdir(path))}
+
+def test_pipeline_matches_sequential(mp, config, pkgsinfo, make_pkginfo, tmp_path):
+	make_items(make_pkginfo)
+	copy = str(tmp_path / "copy")
+	shutil.copytree(pkgsinfo, copy)
+	sequential = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml")
+	result = sequential.prep_all_promotions()
+	promoted, skipped = sequential.promote(result)
+	pipelined = mp.Promoter(munki_path=copy, config=config, config_path="config.yml")
+	pipelined_result, pipelined_skipped = pipelined.promote_pipelined()
+	assert skipped == pipelined_skipped == []
+	assert catalogs(pkgsinfo) == catalogs(copy)
+	assert [(promotion["promotion"], promotion["names"], promotion["versions"]) for promotion in promoted["promotions"]] == \
+		[(promotion["promotion"], promotion["names"], promotion["versions"]) for promotion in pipelined_result["promotions"]]
+	# missing edit dates are written by both
+	assert "munki-promoter_edit_date" in read_pkginfo(os.path.join(copy, "Zoom-5.plist"))["_metadata"]
+	assert sequential.summary.keys() == pipelined.summary.keys()
+
+def test_pipeline_leaves_out_unwritten_items(mp, config, pkgsinfo, make_pkginfo, monkeypatch):
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	make_pkginfo("Slack", "4.0", ["autopkg"], edited=10)
+	write_item = mp.write_item
+	def skip_firefox(storage, item_path, *args):
+		if item_path == firefox:
+			return None
+		return write_item(storage, item_path, *args)
+	monkeypatch.setattr(mp, "write_item", skip_firefox)
+	promoter = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml")
+	result, skipped = promoter.promote_pipelined()
+	assert skipped == [firefox]
+	assert result["promotions"][0]["names"] == ["Slack"]
+	assert not firefox in [path for path, _ in result["items"]]
+
+def test_pipeline_stops_when_evaluation_stops(mp, config, pkgsinfo, make_pkginfo, monkeypatch):
+	for version in range(20):
+		make_pkginfo("Firefox", str(version), ["autopkg"], edited=10)
+	def stop(*args):
+		raise Stop()
+	monkeypatch.setattr(mp, "prep_pkginfo_all_promotions", stop)
+	storage = mp.LocalStorage(pkgsinfo)
+	raised = []
+	def run():
+		try:
+			mp.promote_all_pipelined(config, storage, "config.yml", queue_size=1, readers=2)
+		except Stop as e:
+			raised.append(e)
+	thread = threading.Thread(target=run, daemon=True)
+	thread.start()
+	thread.join(timeout=10)
+	assert not thread.is_alive()
+	assert len(raised) == 1
+	assert all(item == ["autopkg"] for item in catalogs(pkgsinfo).values())
@@ -0,0 +1,46 @@
+import hashlib
+import os
+
+from conftest import read_pkginfo
+
+def hash_tree(path):
+	digest = hashlib.sha256()
+	for root, dirs, files in sorted(os.walk(path)):
+		for file in sorted(files):
+			with open(os.path.join(root, file), "rb") as fp:
+				digest.update(fp.read())
+	return digest.hexdigest()
+
+def test_prep_does_not_write(mp, config, pkgsinfo, make_pkginfo):
+	make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	undated = make_pkginfo("Slack", "4.0", ["staging", "autopkg"])
+	make_pkginfo("Zoom", "5", ["autopkg"])
+	before = hash_tree(pkgsinfo)
+	promoter = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml")
+	promoter.prep_promotion("staging")
+	result = promoter.prep_all_promotions()
+	assert hash_tree(pkgsinfo) == before
+	assert sorted(path for path, _ in result["missing_edit_dates"]) == sorted([undated, os.path.join(pkgsinfo, "Zoom-5.plist")])
+	promoter.promote(result)
+	assert "munki-promoter_edit_date" in read_pkginfo(undated)["_metadata"]
+	assert read_pkginfo(undated)["catalogs"] == ["staging", "autopkg"]
+
+def test_prep_does_not_write_state_store(mp, config, pkgsinfo, make_pkginfo, tmp_path):
+	undated = make_pkginfo("Slack", "4.0", ["staging", "autopkg"])
+	state_store = mp.EditDateStore(str(tmp_path / "state.db"))
+	promoter = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml", state_store=state_store)
+	result = promoter.prep_all_promotions()
+	assert state_store.get_edit_date(undated, read_pkginfo(undated)) is None
+	promoter.record_missing_edit_dates(result)
+	assert state_store.get_edit_date(undated, read_pkginfo(undated)) is not None
+	assert not "munki-promoter_edit_date" in read_pkginfo(undated)["_metadata"]
+
+def test_summary_is_per_promoter(mp, config, pkgsinfo, make_pkginfo):
+	make_pkginfo("Firefox", "1.0", ["autopkg"], created=10)
+	first = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml")
+	second = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml")
+	first.prep_all_promotions()
+	first.prep_all_promotions()
+	assert {event: len(paths) for event, paths in first.summary.items()} == {"creation_date": 1}
+	assert second.summary == dict()
+	assert second.evaluators == dict()
@@ -0,0 +1,143 @@
+import datetime
+import os
+import plistlib
+
+import pytest
+
+pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+BUCKET = "munki"
+PREFIX = "repo/pkgsinfo/"
+
+def pkginfo(name, version, catalogs, edited=None):
+	item = {"name": name, "version": version, "catalogs": catalogs, "_metadata": dict()}
+	if edited is not None:
+		item["_metadata"]["munki-promoter_edit_date"] = datetime.datetime.now().replace(microsecond=0) - datetime.timedelta(days=edited)
+	return plistlib.dumps(item)
+
+@pytest.fixture
+def client(monkeypatch):
+	monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+	monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+	monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+	import boto3
+	with moto.mock_aws():
+		client = boto3.client("s3")
+		client.create_bucket(Bucket=BUCKET)
+		client.put_object(Bucket=BUCKET, Key=PREFIX + "Firefox-1.0.plist", Body=pkginfo("Firefox", "1.0", ["autopkg"], edited=10))
+		client.put_object(Bucket=BUCKET, Key=PREFIX + "Slack-4.0.plist", Body=pkginfo("Slack", "4.0", ["autopkg"], edited=1))
+		client.put_object(Bucket=BUCKET, Key=PREFIX + ".hidden", Body=b"")
+		yield client
+
+@pytest.fixture
+def cache(tmp_path):
+	return str(tmp_path / "cache")
+
+def get_item(client, key):
+	return plistlib.loads(client.get_object(Bucket=BUCKET, Key=key)["Body"].read())
+
+def test_list_and_read(mp, client, cache):
+	storage = mp.S3Storage(f"s3://{BUCKET}/{PREFIX}", cache_dir=cache)
+	keys = sorted(key for key, _, _ in storage.list_items())
+	assert keys == [PREFIX + "Firefox-1.0.plist", PREFIX + "Slack-4.0.plist"]
+	assert plistlib.loads(storage.read_item(PREFIX + "Firefox-1.0.plist"))["name"] == "Firefox"
+	# unchanged objects are read from the cache by the next run
+	storage = mp.S3Storage(f"s3://{BUCKET}/{PREFIX}", cache_dir=cache)
+	storage.list_items()
+	def fail(**kwargs):
+		raise AssertionError("read from S3 instead of the cache")
+	storage.client.get_object = fail
+	assert plistlib.loads(storage.read_item(PREFIX + "Firefox-1.0.plist"))["name"] == "Firefox"
+
+def test_write_conflict(mp, client, cache):
+	key = PREFIX + "Firefox-1.0.plist"
+	storage = mp.S3Storage(f"s3://{BUCKET}/{PREFIX}", cache_dir=cache)
+	storage.list_items()
+	storage.read_item(key)
+	client.put_object(Bucket=BUCKET, Key=key, Body=pkginfo("Firefox", "1.0", ["production"]))
+	with pytest.raises(mp.WriteConflictError):
+		storage.write_item(key, pkginfo("Firefox", "1.0", ["staging", "autopkg"]))
+	assert get_item(client, key)["catalogs"] == ["production"]
+	# the changed object is read again, not from the cache
+	assert plistlib.loads(storage.read_item(key))["catalogs"] == ["production"]
+	storage.write_item(key, pkginfo("Firefox", "1.0", ["staging", "autopkg"]))
+	assert get_item(client, key)["catalogs"] == ["staging", "autopkg"]
+
+def test_promote(mp, config, client, cache):
+	storage = mp.S3Storage(f"s3://{BUCKET}/{PREFIX}", cache_dir=cache)
+	promoter = mp.Promoter(config=config, config_path="config.yml", storage=storage)
+	promoted, skipped = promoter.promote(promoter.prep_all_promotions())
+	assert skipped == []
+	assert [path for path, _ in promoted["items"]] == [PREFIX + "Firefox-1.0.plist"]
+	assert get_item(client, PREFIX + "Firefox-1.0.plist")["catalogs"] == ["staging", "autopkg"]
+	assert get_item(client, PREFIX + "Slack-4.0.plist")["catalogs"] == ["autopkg"]
+
+def test_prune_cache_only_removes_cache_files(mp, client, cache):
+	storage = mp.S3Storage(f"s3://{BUCKET}/{PREFIX}", cache_dir=cache)
+	storage.list_items()
+	storage.read_item(PREFIX + "Firefox-1.0.plist")
+	other = os.path.join(cache, "notes.txt")
+	with open(other, "w") as fp:
+		fp.write("not a cached object")
+	outdated = storage.get_cache_path(PREFIX + "Firefox-1.0.plist", '"outdated"')
+	with open(outdated, "wb") as fp:
+		fp.write(b"")
+	storage.close()
+	assert os.path.exists(other)
+	assert not os.path.exists(outdated)
+	assert os.path.exists(storage.get_cache_path(PREFIX + "Firefox-1.0.plist", storage.etags[PREFIX + "Firefox-1.0.plist"]))
+
+def lock_keys(client):
+	return sorted(obj["Key"] for obj in client.list_objects_v2(Bucket=BUCKET, Prefix=PREFIX + ".munki-promoter.lock").get("Contents", []))
+
+@pytest.fixture
+def no_wait(mp, monkeypatch):
+	monkeypatch.setattr(mp, "LOCK_RETRY_DELAY", 0)
+	monkeypatch.setattr(mp, "LOCK_TIMEOUT", 0)
+
+def test_exclusive_lock(mp, client, no_wait):
+	first = mp.S3Storage(f"s3://{BUCKET}/{PREFIX}")
+	first.lock_repo(exclusive=True)
+	assert lock_keys(client) == [PREFIX + ".munki-promoter.lock"]
+	for exclusive in [True, False]:
+		with pytest.raises(mp.PromoterError):
+			mp.S3Storage(f"s3://{BUCKET}/{PREFIX}").lock_repo(exclusive=exclusive)
+	# the runs that gave up leave nothing behind
+	assert lock_keys(client) == [PREFIX + ".munki-promoter.lock"]
+	first.close()
+	assert lock_keys(client) == []
+	second = mp.S3Storage(f"s3://{BUCKET}/{PREFIX}")
+	second.lock_repo(exclusive=True)
+	second.close()
+
+def test_exclusive_lock_waits_for_shared(mp, client, no_wait):
+	shared = [mp.S3Storage(f"s3://{BUCKET}/{PREFIX}") for _ in range(2)]
+	for storage in shared:
+		storage.lock_repo(exclusive=False)
+	assert len(lock_keys(client)) == 2
+	with pytest.raises(mp.PromoterError):
+		mp.S3Storage(f"s3://{BUCKET}/{PREFIX}").lock_repo(exclusive=True)
+	assert not PREFIX + ".munki-promoter.lock" in lock_keys(client)
+	for storage in shared:
+		storage.close()
+	exclusive = mp.S3Storage(f"s3://{BUCKET}/{PREFIX}")
+	exclusive.lock_repo(exclusive=True)
+	exclusive.close()
+	assert lock_keys(client) == []
+
+@pytest.mark.parametrize("key", [".munki-promoter.lock", ".munki-promoter.lock.shared.crashed"])
+def test_stale_lock_is_removed(mp, client, no_wait, key):
+	created = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=mp.LOCK_STALE_AFTER + 60)
+	client.put_object(Bucket=BUCKET, Key=PREFIX + key, Body=mp.json.dumps({"owner": "crashed:1", "created": created.isoformat()}).encode())
+	storage = mp.S3Storage(f"s3://{BUCKET}/{PREFIX}")
+	storage.lock_repo(exclusive=True)
+	assert lock_keys(client) == [PREFIX + ".munki-promoter.lock"]
+	storage.close()
+
+def test_recent_lock_without_owner_is_kept(mp, client, no_wait):
+	# lock objects of older versions have no body, their age is taken from S3
+	client.put_object(Bucket=BUCKET, Key=PREFIX + ".munki-promoter.lock", Body=b"")
+	with pytest.raises(mp.PromoterError):
+		mp.S3Storage(f"s3://{BUCKET}/{PREFIX}").lock_repo(exclusive=False)
+	assert lock_keys(client) == [PREFIX + ".munki-promoter.lock"]
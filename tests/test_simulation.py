@@ -0,0 +1,41 @@
+import datetime
+import types
+
+import pytest
+
+DAYS = 14
+
+def fake_clock(mp, monkeypatch, now):
+	# replaces the clock of munki-promoter, so daily runs can be made without waiting for them
+	class FakeDatetime(datetime.datetime):
+		@classmethod
+		def now(cls, tz=None):
+			return now[0]
+	monkeypatch.setattr(mp, "datetime", types.SimpleNamespace(datetime=FakeDatetime, timedelta=datetime.timedelta, timezone=datetime.timezone))
+
+@pytest.mark.parametrize("use_state_store", [False, True])
+def test_simulation_matches_daily_runs(mp, config, pkgsinfo, make_pkginfo, monkeypatch, tmp_path, use_state_store):
+	config["selections"] = [{"type": "exclusion", "key": "name", "values": ["Chrome"]}]
+	mp.check_config(config, "config.yml")
+	make_pkginfo("Firefox", "1.0", ["autopkg"], created=1)
+	make_pkginfo("Firefox", "2.0", ["autopkg"], edited=2)
+	make_pkginfo("Slack", "4.0", ["staging", "autopkg"], edited=2)
+	make_pkginfo("Zoom", "5", ["autopkg"])
+	make_pkginfo("Chrome", "1", ["autopkg"], created=10)
+	make_pkginfo("Office", "16", ["production"], edited=10)
+	start = datetime.datetime.now()
+	now = [start]
+	fake_clock(mp, monkeypatch, now)
+	state_store = mp.EditDateStore(str(tmp_path / "state.db")) if use_state_store else None
+	promoter = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml", state_store=state_store)
+	schedule = promoter.simulate(DAYS)
+	simulated = [(day["day"], promotion["promotion"], promotion["path"], promotion["promote_to"]) for day in schedule for promotion in day["promotions"]]
+	ran = []
+	for day in range(DAYS + 1):
+		now[0] = start + datetime.timedelta(days=day)
+		promoted, skipped = promoter.promote(promoter.prep_all_promotions())
+		assert skipped == []
+		ran += [(day, promotion, path, item["catalogs"]) for promotion, _, item, (_, _, (path, _), _) in promoted["records"]]
+	assert sorted(simulated) == sorted(ran)
+	# every item but the excluded and the fully promoted ones is promoted at least once
+	assert sorted(set(path.rsplit("/", 1)[1] for _, _, path, _ in ran)) == ["Firefox-1.0.plist", "Firefox-2.0.plist", "Slack-4.0.plist", "Zoom-5.plist"]
@@ -0,0 +1,27 @@
+import pytest
+
+pytest.importorskip("numpy")
+
+def describe(result):
+	return [(promotion["promotion"], promotion["names"], promotion["versions"]) for promotion in result["promotions"]]
+
+def test_vectorised_matches_sequential(mp, config, pkgsinfo, make_pkginfo):
+	config["selections"] = [{"type": "exclusion", "key": "name", "values": ["Chrome"]}]
+	mp.check_config(config, "config.yml")
+	make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	make_pkginfo("Slack", "4.0", ["staging", "autopkg"], edited=10)
+	make_pkginfo("Zoom", "5", ["autopkg"])
+	make_pkginfo("Chrome", "1", ["autopkg"], created=10)
+	sequential = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml").prep_all_promotions()
+	vectorised = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml", vectorised=True).prep_all_promotions()
+	assert describe(vectorised) == describe(sequential)
+	assert sorted(path for path, _ in vectorised["missing_edit_dates"]) == sorted(path for path, _ in sequential["missing_edit_dates"])
+
+@pytest.mark.parametrize("key", ["catalogs", "munki-promoter_edit_date"])
+def test_vectorised_rejects_selections_on_promoted_state(mp, config, pkgsinfo, make_pkginfo, key):
+	config["selections"] = [{"type": "exclusion", "key": key, "values": []}]
+	mp.check_config(config, "config.yml")
+	make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10)
+	promoter = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml", vectorised=True)
+	with pytest.raises(mp.PromoterError):
+		promoter.prep_all_promotions()
@@ -0,0 +1,45 @@
+import hashlib
+import os
+
+import yaml
+
+from conftest import read_pkginfo
+
+def make_pkgs(pkgsinfo):
+	pkgs = os.path.join(os.path.dirname(pkgsinfo), "pkgs")
+	os.mkdir(pkgs)
+	with open(os.path.join(pkgs, "Slack-4.0.pkg"), "wb") as fp:
+		fp.write(b"slack")
+	return pkgs
+
+def test_excluded_items_are_reported(mp, config, pkgsinfo, make_pkginfo):
+	make_pkgs(pkgsinfo)
+	make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10, installer_item_location="Firefox-1.0.pkg", installer_item_hash="0" * 64)
+	make_pkginfo("Slack", "4.0", ["staging", "autopkg"], edited=10, installer_item_location="Slack-4.0.pkg", installer_item_hash=hashlib.sha256(b"slack").hexdigest())
+	promoter = mp.Promoter(munki_path=pkgsinfo, config=config, config_path="config.yml", verify_installers=True)
+	result = promoter.prep_all_promotions()
+	assert [path for path, _ in result["items"]] == [os.path.join(pkgsinfo, "Slack-4.0.plist")]
+	assert promoter.summary["excluded"] == {os.path.join(pkgsinfo, "Firefox-1.0.plist")}
+	# the promotion of which every item was excluded is listed to report why
+	autopkg, staging = result["promotions"]
+	assert (autopkg["promotion"], autopkg["names"]) == ("autopkg", [])
+	assert [(item["name"], item["reason"]) for item in autopkg["excluded"]] == [("Firefox", "installer Firefox-1.0.pkg is missing")]
+	assert (staging["promotion"], staging["names"], staging["excluded"]) == ("staging", ["Slack"], [])
+	md = mp.md_promotions(result)
+	assert "- Firefox: 1.0 (installer Firefox-1.0.pkg is missing)" in md
+	assert "- Slack: 4.0" in md
+
+def test_run_reports_excluded_items_without_promoting(mp, config, pkgsinfo, make_pkginfo, tmp_path):
+	make_pkgs(pkgsinfo)
+	firefox = make_pkginfo("Firefox", "1.0", ["autopkg"], edited=10, installer_item_location="Firefox-1.0.pkg", installer_item_hash="0" * 64)
+	config_file = str(tmp_path / "config.yml")
+	with open(config_file, "w") as fp:
+		yaml.safe_dump(config, fp)
+	md_path = str(tmp_path / "promotions.md")
+	# no --auto, nothing to promote means nothing to confirm
+	mp.run(mp.process_args(["-m", pkgsinfo, "-y", config_file, "--verify-installers", "--installer-hash-cache", str(tmp_path / "hashes.db"), "--markdown", md_path]))
+	assert read_pkginfo(firefox)["catalogs"] == ["autopkg"]
+	with open(md_path) as fp:
+		md = fp.read()
+	assert "- Firefox: 1.0 (installer Firefox-1.0.pkg is missing)" in md
+	assert not "have been automatically promoted" in md